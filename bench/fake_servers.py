@@ -0,0 +1,437 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+"""
+In-memory stand-ins for the katello API and RCS, for benchmarking a sync
+without real services. Each request waits --latency milliseconds before it
+is answered, to model a remote server.
+
+The katello server only covers the calls spacewalk-splice-tool makes, and
+keeps just enough state for a sync to see its own writes. Requests it has no
+route for get a 404 and are counted in GET /_stats, so a mismatch with the
+real API shows up in the benchmark results instead of passing silently.
+"""
+
+import BaseHTTPServer
+import gzip
+import itertools
+import json
+import re
+import SocketServer
+import ssl
+import StringIO
+import sys
+import threading
+import time
+import urlparse
+import uuid
+from optparse import OptionParser
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, latency=0.0, certfile=None, keyfile=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes_in': 0, 'unrouted': {}}
+        if certfile:
+            self.socket = ssl.wrap_socket(self.socket, certfile=certfile,
+                                          keyfile=keyfile, server_side=True)
+
+    def count(self, request_bytes, unrouted=None):
+        self.lock.acquire()
+        try:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += request_bytes
+            if unrouted:
+                self.stats['unrouted'][unrouted] = self.stats['unrouted'].get(unrouted, 0) + 1
+        finally:
+            self.lock.release()
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, which both the katello client and BaseConnection use
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.headers.getheader('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+        return length, body
+
+    def respond(self, status, data=None, content_type='application/json'):
+        if data is None:
+            body = ''
+        elif content_type == 'application/json':
+            body = json.dumps(data)
+        else:
+            body = data
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self):
+        length, body = self.read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse.urlparse(self.path)
+        if url.path == '/_stats':
+            self.server.count(length)
+            self.respond(200, self.server.stats)
+            return
+        result = self.route(self.command, url.path, urlparse.parse_qs(url.query), body)
+        if result is None:
+            self.server.count(length, "%s %s" % (self.command, url.path))
+            self.respond(404, {'displayMessage': 'no fake route for %s %s' % (self.command, url.path)})
+            return
+        self.server.count(length)
+        self.respond(*result)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+    def route(self, method, path, query, body):
+        """
+        returns (status, data) for a request, or None to answer with a 404.
+        Subclasses override this for the calls they fake.
+        """
+        return None
+
+
+def unwrap(data, key):
+    """
+    the katello client wraps some bodies as {"user": {...}}; accept both
+    """
+    if isinstance(data, dict) and isinstance(data.get(key), dict):
+        return data[key]
+    return data
+
+
+class KatelloState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.orgs = {}
+        self.users = {}
+        self.roles = {}
+        self.user_roles = {}
+        self.systems = {}
+        admin = self.add_role('Administrator')
+        self.users[1] = {'id': 1, 'username': 'admin', 'email': 'root@localhost'}
+        self.user_roles[1] = set([admin['id']])
+
+    def next_id(self):
+        return self.ids.next()
+
+    def add_role(self, name):
+        role = {'id': self.next_id(), 'name': name, 'description': ''}
+        self.roles[role['id']] = role
+        return role
+
+    def find_org(self, key):
+        for org in self.orgs.values():
+            if key in (org['label'], org['name']):
+                return org
+        return None
+
+
+class KatelloHandler(FakeHandler):
+    """
+    katello API calls, matched on the path after "/api/" so any api_url
+    prefix works
+    """
+
+    def route(self, method, path, query, body):
+        if '/api/' not in path:
+            return None
+        path = path.split('/api/', 1)[1].rstrip('/')
+        data = None
+        if body and 'multipart/form-data' not in (self.headers.getheader('Content-Type') or ''):
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method:
+                continue
+            match = re.match(pattern + '$', path)
+            if match:
+                state = self.server.state
+                state.lock.acquire()
+                try:
+                    return handler(state, query, data, *match.groups())
+                finally:
+                    state.lock.release()
+        return None
+
+
+def list_orgs(state, query, data):
+    return 200, state.orgs.values()
+
+def create_org(state, query, data):
+    data = unwrap(data, 'organization')
+    org = {'id': state.next_id(), 'name': data['name'], 'label': data['label'],
+           'description': data.get('description', '')}
+    state.orgs[org['label']] = org
+    return 200, org
+
+def delete_org(state, query, data, key):
+    org = state.find_org(key)
+    if org is None:
+        return 404, {'displayMessage': 'no such org'}
+    del state.orgs[org['label']]
+    for system_uuid in [s['uuid'] for s in state.systems.values() if s['owner']['key'] == org['label']]:
+        del state.systems[system_uuid]
+    return 200, {}
+
+def list_systems(state, query, data, org_key):
+    org = state.find_org(org_key)
+    if org is None:
+        return 404, {'displayMessage': 'no such org'}
+    systems = [s for s in state.systems.values() if s['owner']['key'] == org['label']]
+    # find_by_custom_info searches this listing by custom info key
+    for key, values in query.items():
+        if key in ('environment_id', 'search'):
+            continue
+        systems = [s for s in systems
+                   if {'keyname': key, 'value': values[0]} in s['custom_info']]
+    # the same shape as a real listing (see consumer_list in
+    # test/test_checkin.py): no facts, custom info or checkin time, those
+    # only come with get_system
+    summary = []
+    for system in systems:
+        summary.append({'uuid': system['uuid'], 'id': system['id'], 'name': system['name'],
+                        'activation_key': [], 'content_view_id': None,
+                        'created_at': system['created_at'],
+                        'description': 'Initial Registration Params',
+                        'environment': system['environment'],
+                        'environment_id': system['environment']['id'],
+                        'guests': [], 'ipv4_address': None, 'location': 'None',
+                        'serviceLevel': system['serviceLevel'],
+                        'updated_at': system['updated_at']})
+    return 200, summary
+
+def register_system(state, query, data, org_key):
+    org = state.find_org(org_key)
+    if org is None:
+        return 404, {'displayMessage': 'no such org'}
+    data = unwrap(data, 'system')
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    system = {'uuid': str(uuid.uuid4()), 'id': state.next_id(), 'name': data.get('name'),
+              'facts': data.get('facts') or {},
+              'installedProducts': data.get('installedProducts') or [],
+              'owner': {'key': org['label'], 'displayName': org['name']},
+              'environment': {'id': org['id'], 'organization_id': org['id']},
+              'serviceLevel': '', 'custom_info': [],
+              'created_at': now, 'updated_at': now, 'checkin_time': now}
+    state.systems[system['uuid']] = system
+    return 200, system
+
+def get_system(state, query, data, system_uuid):
+    if system_uuid not in state.systems:
+        return 404, {'displayMessage': 'no such system'}
+    return 200, state.systems[system_uuid]
+
+def update_system(state, query, data, system_uuid):
+    if system_uuid not in state.systems:
+        return 404, {'displayMessage': 'no such system'}
+    system = state.systems[system_uuid]
+    system.update(unwrap(data, 'system') or {})
+    system['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    return 200, system
+
+def checkin_system(state, query, data, system_uuid):
+    if system_uuid not in state.systems:
+        return 404, {'displayMessage': 'no such system'}
+    state.systems[system_uuid]['checkin_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    return 200, state.systems[system_uuid]
+
+def delete_system(state, query, data, system_uuid):
+    state.systems.pop(system_uuid, None)
+    return 200, {}
+
+def no_content(state, query, data, *args):
+    return 200, {}
+
+def system_subscriptions(state, query, data, system_uuid):
+    return 200, {'entitlements': [{'accountNumber': '1234', 'contractNumber': '5678',
+                                   'productId': 'RH0103708', 'quantity': 1}]}
+
+def subscription_status(state, query, data, system_uuid):
+    return 200, {'status': 'valid', 'reasons': []}
+
+def add_custom_info(state, query, data, informable_id):
+    for system in state.systems.values():
+        if str(system['id']) == informable_id:
+            system['custom_info'].append({'keyname': data.get('keyname'),
+                                          'value': data.get('value')})
+            return 200, system['custom_info']
+    return 404, {'displayMessage': 'no such system'}
+
+def create_distributor(state, query, data, org_key=None):
+    return 200, {'uuid': str(uuid.uuid4()), 'name': unwrap(data, 'distributor').get('name')}
+
+def export_manifest(state, query, data, distributor_uuid):
+    return 200, 'PK\x05\x06' + '\x00' * 18, 'application/zip'
+
+def list_providers(state, query, data, org_key):
+    org = state.find_org(org_key)
+    if org is None:
+        return 404, {'displayMessage': 'no such org'}
+    return 200, [{'id': org['id'], 'name': 'Red Hat'}]
+
+def list_users(state, query, data):
+    return 200, state.users.values()
+
+def create_user(state, query, data):
+    data = unwrap(data, 'user')
+    user = {'id': state.next_id(), 'username': data.get('username') or data.get('name'),
+            'email': data.get('email')}
+    state.users[user['id']] = user
+    return 200, user
+
+def delete_user(state, query, data, user_id):
+    state.users.pop(int(user_id), None)
+    state.user_roles.pop(int(user_id), None)
+    return 200, {}
+
+def user_roles(state, query, data, user_id):
+    return 200, [state.roles[r] for r in sorted(state.user_roles.get(int(user_id), ()))]
+
+def assign_role(state, query, data, user_id):
+    state.user_roles.setdefault(int(user_id), set()).add(int(data['role_id']))
+    return 200, {}
+
+def unassign_role(state, query, data, user_id, role_id):
+    state.user_roles.get(int(user_id), set()).discard(int(role_id))
+    return 200, {}
+
+def list_roles(state, query, data):
+    roles = state.roles.values()
+    if 'name' in query:
+        roles = [r for r in roles if r['name'] == query['name'][0]]
+    return 200, roles
+
+def create_role(state, query, data):
+    return 200, state.add_role(unwrap(data, 'role')['name'])
+
+
+ROUTES = [
+    ('GET', r'organizations', list_orgs),
+    ('POST', r'organizations', create_org),
+    ('DELETE', r'organizations/([^/]+)', delete_org),
+    ('GET', r'organizations/([^/]+)/systems', list_systems),
+    ('POST', r'organizations/([^/]+)/systems', register_system),
+    ('GET', r'systems/([^/]+)', get_system),
+    ('PUT', r'systems/([^/]+)', update_system),
+    ('DELETE', r'systems/([^/]+)', delete_system),
+    ('PUT', r'systems/([^/]+)/checkin', checkin_system),
+    ('PUT', r'systems/([^/]+)/refresh_subscriptions', no_content),
+    ('POST', r'systems/([^/]+)/refresh_subscriptions', no_content),
+    ('GET', r'systems/([^/]+)/subscriptions', system_subscriptions),
+    ('GET', r'systems/([^/]+)/subscription_status', subscription_status),
+    ('DELETE', r'consumers/([^/]+)/deletionrecord', no_content),
+    ('POST', r'custom_info/system/([^/]+)', add_custom_info),
+    ('POST', r'organizations/([^/]+)/distributors', create_distributor),
+    ('POST', r'distributors', create_distributor),
+    ('GET', r'distributors/([^/]+)/export', export_manifest),
+    ('GET', r'organizations/([^/]+)/providers', list_providers),
+    ('POST', r'providers/([^/]+)/import_manifest', no_content),
+    ('GET', r'users', list_users),
+    ('POST', r'users', create_user),
+    ('DELETE', r'users/([^/]+)', delete_user),
+    ('GET', r'users/([^/]+)/roles', user_roles),
+    ('POST', r'users/([^/]+)/roles', assign_role),
+    ('DELETE', r'users/([^/]+)/roles/([^/]+)', unassign_role),
+    ('GET', r'roles', list_roles),
+    ('POST', r'roles', create_role),
+    ('POST', r'roles/([^/]+)/permissions', no_content),
+]
+
+
+class RcsHandler(FakeHandler):
+    """
+    accepts splice server metadata and marketing product usage uploads,
+    counting the usage records it is sent
+    """
+
+    def route(self, method, path, query, body):
+        if method != 'POST':
+            return None
+        if not (path.endswith('/spliceserver/') or path.endswith('/marketingproductusage/')):
+            return None
+        try:
+            records = len(json.loads(body).get('objects', []))
+        except (ValueError, AttributeError):
+            return 400, {'error': 'body is not a JSON objects list'}
+        if not path.endswith('/marketingproductusage/'):
+            # the splice server metadata is not a usage record
+            return 202, {}
+        stats = self.server.stats
+        self.server.lock.acquire()
+        try:
+            stats['records'] = stats.get('records', 0) + records
+        finally:
+            self.server.lock.release()
+        return 202, {}
+
+
+def start_server(kind, port=0, latency=0.0, certfile=None, keyfile=None):
+    """
+    starts a fake server in a background thread and returns it; the port it
+    listens on is server.server_port
+    """
+    handler = {'katello': KatelloHandler, 'rcs': RcsHandler}[kind]
+    server = FakeServer(('127.0.0.1', port), handler, latency, certfile, keyfile)
+    if kind == 'katello':
+        server.state = KatelloState()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] katello|rcs")
+    parser.add_option("--port", dest="port", type="int", default=0)
+    parser.add_option("--latency", dest="latency", type="float", default=0.0,
+                      help="milliseconds to wait before answering each request")
+    parser.add_option("--cert", dest="certfile", help="serve HTTPS with this certificate")
+    parser.add_option("--key", dest="keyfile")
+    (options, args) = parser.parse_args()
+    if len(args) != 1 or args[0] not in ('katello', 'rcs'):
+        parser.error("say which server to run: katello or rcs")
+    server = start_server(args[0], options.port, options.latency / 1000.0,
+                          options.certfile, options.keyfile)
+    # the harness reads the port from the first line
+    print server.server_port
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
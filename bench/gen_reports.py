@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+"""
+Writes synthetic spacewalk-report output (splice-export, users,
+cloned-channels and hostguests) for a fleet of a given size, in the CSV
+format the reports print over ssh. The data is seeded, so the same size
+always gives the same files.
+"""
+
+import csv
+import os
+import random
+import sys
+from optparse import OptionParser
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000}
+
+SYSTEM_COLUMNS = ['server_id', 'organization', 'org_id', 'name', 'hostname',
+                  'ip_address', 'ipv6_address', 'registered_by',
+                  'registration_time', 'last_checkin_time', 'software_channel',
+                  'entitlements', 'system_group', 'virtual_host',
+                  'architecture', 'hardware', 'memory', 'sockets']
+USER_COLUMNS = ['username', 'first_name', 'last_name', 'user_id',
+                'last_login_time', 'creation_time', 'organization_id', 'role',
+                'position', 'active', 'organization', 'email']
+CHANNEL_COLUMNS = ['original_channel_label', 'original_channel_name',
+                   'new_channel_label', 'new_channel_name']
+HOST_GUEST_COLUMNS = ['server_id', 'guests']
+
+BASE_CHANNELS = ['rhel-x86_64-server-6', 'rhel-i386-server-6',
+                 'rhel-x86_64-server-5', 'rhel-x86_64-workstation-6',
+                 'rhel-x86_64-client-6', 'jb-ewp-5-x86_64-server-6-rpm']
+ROLES = ['', 'Organization Administrator',
+         'Organization Administrator;Satellite Administrator']
+
+FIRST_SERVER_ID = 1000010000
+
+
+def org_count(systems):
+    # roughly one org per thousand systems, which gives the owner and role
+    # sync some work without drowning the run in manifests
+    return max(1, systems / 1000)
+
+
+def channel_rows(orgs):
+    """
+    a clone of every base channel per org, and a clone of that clone, so
+    channel resolution has chains to follow
+    """
+    rows = []
+    for org_id in range(1, orgs + 1):
+        for base in BASE_CHANNELS:
+            clone = 'org%s-clone-%s' % (org_id, base)
+            rows.append({'original_channel_label': base,
+                         'original_channel_name': base,
+                         'new_channel_label': clone,
+                         'new_channel_name': 'Clone of %s' % base})
+            rows.append({'original_channel_label': clone,
+                         'original_channel_name': 'Clone of %s' % base,
+                         'new_channel_label': 'dev-' + clone,
+                         'new_channel_name': 'Dev clone of %s' % base})
+    return rows
+
+
+def hardware(rand, cpus, sockets):
+    nics = ['%s CPUs %s Sockets' % (cpus, sockets)]
+    for n in range(rand.randint(1, 3)):
+        nics.append('eth%s 10.%s.%s.%s/255.255.255.0 52:54:00:%02x:%02x:%02x' %
+                    (n, rand.randint(0, 255), rand.randint(0, 255), rand.randint(1, 254),
+                     rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255)))
+    nics.append('lo 127.0.0.1/255.0.0.0 00:00:00:00:00:00')
+    return '; '.join(nics)
+
+
+def system_rows(systems, orgs, seed=0):
+    rand = random.Random(seed)
+    hosts = []
+    for n in range(systems):
+        server_id = FIRST_SERVER_ID + n
+        org_id = n % orgs + 1
+        sockets = rand.choice([1, 1, 2, 2, 4])
+        cpus = sockets * rand.choice([1, 2, 4, 8])
+        base = rand.choice(BASE_CHANNELS)
+        channel = rand.choice([base, 'org%s-clone-%s' % (org_id, base),
+                               'dev-org%s-clone-%s' % (org_id, base)])
+        # a quarter of the fleet are guests of earlier systems
+        virtual_host = ''
+        if hosts and rand.random() < 0.25:
+            virtual_host = str(rand.choice(hosts))
+        else:
+            hosts.append(server_id)
+        hostname = 'host%s.org%s.example.com' % (n, org_id)
+        yield {'server_id': str(server_id),
+               'organization': 'Org %s' % org_id,
+               'org_id': str(org_id),
+               'name': hostname,
+               'hostname': hostname,
+               'ip_address': '10.%s.%s.%s' % (org_id % 256, n / 256 % 256, n % 256),
+               'ipv6_address': '::1',
+               'registered_by': 'admin',
+               'registration_time': '2013-04-%02d 15:25:08' % rand.randint(1, 28),
+               'last_checkin_time': '2013-05-%02d %02d:%02d:34' %
+                    (rand.randint(1, 28), rand.randint(0, 23), rand.randint(0, 59)),
+               'software_channel': channel,
+               'entitlements': 'Spacewalk Management Entitled Servers',
+               'system_group': '',
+               'virtual_host': virtual_host,
+               'architecture': base.split('-')[1] if base.startswith('rhel') else 'x86_64',
+               'hardware': hardware(rand, cpus, sockets),
+               'memory': str(rand.choice([2048, 4096, 7466, 16384, 65536])),
+               'sockets': str(sockets)}
+
+
+def user_rows(orgs):
+    rows = []
+    for org_id in range(1, orgs + 1):
+        for n, role in enumerate(ROLES):
+            username = 'user%s-%s' % (org_id, n)
+            rows.append({'username': username, 'first_name': 'First',
+                         'last_name': 'Last', 'user_id': str(org_id * 10 + n),
+                         'last_login_time': '2013-05-01 13:27:31',
+                         'creation_time': '2013-04-25 08:28:08',
+                         'organization_id': str(org_id), 'role': role,
+                         'position': '', 'active': 'enabled',
+                         'organization': 'Org %s' % org_id,
+                         'email': '%s@example.com' % username})
+    return rows
+
+
+def host_guest_rows(systems):
+    guests = {}
+    for row in systems:
+        if row['virtual_host']:
+            guests.setdefault(row['virtual_host'], []).append(row['server_id'])
+    return [{'server_id': host, 'guests': ';'.join(ids)}
+            for host, ids in sorted(guests.items())]
+
+
+def write_report(path, columns, rows):
+    f = open(path, 'wb')
+    try:
+        writer = csv.DictWriter(f, columns)
+        f.write(','.join(columns) + '\r\n')
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        f.close()
+
+
+def generate(report_dir, systems, seed=0):
+    """
+    writes the four reports for `systems` systems into report_dir, named as
+    the spacewalk-report commands are
+    """
+    if not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    orgs = org_count(systems)
+    system_data = list(system_rows(systems, orgs, seed))
+    write_report(os.path.join(report_dir, 'splice-export'), SYSTEM_COLUMNS, system_data)
+    write_report(os.path.join(report_dir, 'users'), USER_COLUMNS, user_rows(orgs))
+    write_report(os.path.join(report_dir, 'cloned-channels'), CHANNEL_COLUMNS, channel_rows(orgs))
+    write_report(os.path.join(report_dir, 'hostguests'), HOST_GUEST_COLUMNS,
+                 host_guest_rows(system_data))
+    return report_dir
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] OUTPUT_DIR")
+    parser.add_option("--size", dest="size", default="1k",
+                      help="fleet size: %s, or a number of systems" % ', '.join(sorted(SIZES)))
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("an output directory is required")
+    systems = SIZES.get(options.size) or int(options.size)
+    generate(args[0], systems, options.seed)
+    print "wrote reports for %s systems to %s" % (systems, args[0])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+"""
+Runs spacewalk_sync and splice_sync end to end against generated spacewalk
+reports and the fake katello and RCS servers, and writes throughput and peak
+memory for each fleet size to a JSON file.
+
+Each sync runs in its own process so its peak RSS is not mixed up with the
+fake servers or with earlier sizes. The reports are read with cat instead
+of over ssh, everything else is the code that ships.
+"""
+
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from ConfigParser import SafeConfigParser
+from optparse import OptionParser, SUPPRESS_HELP
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(TOP_DIR, 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_servers
+import gen_reports
+
+# the product mapping from the unit tests stands in for /usr/share/rhsm
+PRODUCT_DATA_DIR = os.path.join(TOP_DIR, 'test', 'data')
+PRODUCT_RELEASE = 'RHEL-6.4'
+
+
+def make_cert(work_dir):
+    """
+    a self-signed certificate for the fake servers, which also serves as
+    the splice identity cert and CA
+    """
+    cert = os.path.join(work_dir, 'bench.cert')
+    key = os.path.join(work_dir, 'bench.key')
+    subprocess.check_call(['openssl', 'req', '-x509', '-nodes', '-newkey', 'rsa:2048',
+                           '-days', '1', '-subj', '/CN=bench-splice-server',
+                           '-keyout', key, '-out', cert],
+                          stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    return cert, key
+
+
+def write_config(path, work_dir, katello_port, rcs_port, cert, key, metrics_file):
+    config = SafeConfigParser()
+    config.read(os.path.join(TOP_DIR, 'etc', 'splice', 'checkin.conf'))
+    config.set('main', 'state_dir', os.path.join(work_dir, 'state'))
+    config.set('main', 'metrics_file', metrics_file)
+    config.set('splice', 'hostname', '127.0.0.1')
+    config.set('splice', 'port', str(rcs_port))
+    config.set('splice', 'splice_id_cert', cert)
+    config.set('splice', 'splice_id_key', key)
+    config.set('splice', 'splice_ca_cert', cert)
+    config.set('splice', 'upload_retry_delay', '0')
+    config.set('logging', 'config', '')
+    config.set('spacewalk', 'host', 'bench')
+    config.set('katello', 'hostname', '127.0.0.1')
+    config.set('katello', 'port', str(katello_port))
+    config.set('katello', 'proto', 'https')
+    f = open(path, 'w')
+    try:
+        config.write(f)
+    finally:
+        f.close()
+
+
+def run_sync(config_file, report_dir):
+    """
+    child side: run checkin.main with the bench config, reading the reports
+    from report_dir, and print the resource usage as JSON
+    """
+    from spacewalk_splice_tool import constants, utils
+    # these are read when checkin and katello_connect are imported
+    constants.SPLICE_CHECKIN_CONFIG = config_file
+    constants.CHANNEL_PRODUCT_ID_MAPPING_DIR = PRODUCT_DATA_DIR
+    utils.get_release = lambda: PRODUCT_RELEASE
+    from spacewalk_splice_tool import checkin, sw_client
+
+    class ReportDirClient(sw_client.SpacewalkClient):
+        def connect(self):
+            pass
+
+        def close(self):
+            pass
+
+        def _ssh_command(self, report_path):
+            return ['cat', os.path.join(report_dir, report_path)]
+
+    checkin.SpacewalkClient = ReportDirClient
+    checkin.CERT_DIR_PATH = os.path.join(PRODUCT_DATA_DIR, PRODUCT_RELEASE)
+
+    class Options(object):
+        spacewalk_sync = None
+        splice_sync = None
+        full_sync = True
+        sample_json = None
+        record = None
+        replay = None
+        replay_latency = False
+
+    start = time.time()
+    checkin.main(Options())
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print json.dumps({'seconds': time.time() - start,
+                      'maxrss_kb': usage.ru_maxrss,
+                      'cpu_seconds': usage.ru_utime + usage.ru_stime,
+                      'workers_maxrss_kb': workers.ru_maxrss,
+                      'workers_cpu_seconds': workers.ru_utime + workers.ru_stime})
+
+
+def bench_size(name, systems, work_dir, options, cert, key):
+    size_dir = os.path.join(work_dir, name)
+    report_dir = gen_reports.generate(os.path.join(size_dir, 'reports'), systems)
+    katello = fake_servers.start_server('katello', latency=options.latency / 1000.0,
+                                        certfile=cert, keyfile=key)
+    rcs = fake_servers.start_server('rcs', latency=options.latency / 1000.0,
+                                    certfile=cert, keyfile=key)
+    try:
+        config_file = os.path.join(size_dir, 'checkin.conf')
+        metrics_file = os.path.join(size_dir, 'metrics.json')
+        write_config(config_file, size_dir, katello.server_port, rcs.server_port,
+                     cert, key, metrics_file)
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                  '--run-sync', config_file, report_dir],
+                                 stdout=subprocess.PIPE)
+        output = child.communicate()[0]
+        result = {'size': name, 'systems': systems, 'exit_status': child.returncode}
+        if child.returncode == 0:
+            usage = json.loads(output.strip().splitlines()[-1])
+            result.update(usage)
+            result['systems_per_second'] = systems / usage['seconds']
+        # a full sync, see metrics.mode_path
+        run_metrics = os.path.join(size_dir, 'metrics-full.json')
+        if os.path.exists(run_metrics):
+            result['phases'] = json.load(open(run_metrics))['phases']
+        result['katello'] = katello.stats
+        result['rcs'] = rcs.stats
+        return result
+    finally:
+        katello.shutdown()
+        rcs.shutdown()
+
+
+def main():
+    parser = OptionParser(description="Benchmark a full sync against fake services")
+    parser.add_option("--sizes", dest="sizes", default="1k",
+                      help="comma separated fleet sizes, from %s or a number "
+                           "of systems (default 1k)" % ', '.join(sorted(gen_reports.SIZES)))
+    parser.add_option("--latency", dest="latency", type="float", default=0.0,
+                      help="milliseconds the fake servers wait per request")
+    parser.add_option("--output", dest="output", default="bench-results.json",
+                      help="where to write the results")
+    parser.add_option("--work-dir", dest="work_dir", default=None,
+                      help="keep reports, state and logs here instead of a temp dir")
+    parser.add_option("--run-sync", dest="run_sync", action="store_true",
+                      help=SUPPRESS_HELP)
+    (options, args) = parser.parse_args()
+
+    if options.run_sync:
+        return run_sync(*args)
+
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix='sst-bench-')
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    try:
+        cert, key = make_cert(work_dir)
+        results = {'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                   'python': platform.python_version(),
+                   'host': platform.node(),
+                   'latency_ms': options.latency,
+                   'runs': []}
+        for name in options.sizes.split(','):
+            systems = gen_reports.SIZES.get(name) or int(name)
+            print "benchmarking %s systems..." % systems
+            run = bench_size(name, systems, work_dir, options, cert, key)
+            results['runs'].append(run)
+            if run['exit_status'] == 0:
+                print "  %.1f seconds, %.1f systems/s, peak rss %s kB" % \
+                    (run['seconds'], run['systems_per_second'], run['maxrss_kb'])
+            else:
+                print "  sync failed with status %s" % run['exit_status']
+        f = open(options.output, 'w')
+        try:
+            json.dump(results, f, indent=4)
+        finally:
+            f.close()
+        print "results written to %s" % options.output
+    finally:
+        if not options.work_dir:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -39,6 +39,7 @@ mkdir -p %{buildroot}/%{_sysconfdir}/sysconfig/
 mkdir -p %{buildroot}/%{_sysconfdir}/splice/
 mkdir -p %{buildroot}/%{_bindir}
 mkdir -p %{buildroot}/%{_var}/log/%{name}
+mkdir -p %{buildroot}/%{_var}/lib/%{name}
 mkdir -p %{buildroot}/%{_sysconfdir}/cron.d
 
 # Configuration
@@ -64,6 +65,7 @@ rm -rf %{buildroot}
 %defattr(-,root,root,-)
 %attr(755,root,root) %{_bindir}/spacewalk-splice-checkin
 %{python_sitelib}/spacewalk_splice_tool*
+%dir %{_var}/lib/%{name}
 %config(noreplace) %{_sysconfdir}/splice/checkin.conf
 %config(noreplace) %attr(644,root,root) %{_sysconfdir}/cron.d/spacewalk-sst-sync
 %config(noreplace) %attr(644,root,root) %{_sysconfdir}/cron.d/splice-sst-sync
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+"""
+Record and replay of the traffic a sync sends to katello and RCS, so a slow
+run can be reproduced and profiled offline.
+
+Katello traffic is captured at the katello-cli API objects a
+KatelloConnection holds (orgapi, systemapi, ...), RCS traffic at
+BaseConnection._send. A cassette is a JSON lines file with one call per
+line. While recording, each process appends its own lines, so worker
+processes can share one cassette.
+
+On replay, calls are matched on their API method and arguments, or on verb
+and path for RCS. Identical calls are answered in the order they were
+recorded. With latency on, each answer is delayed by the time the real call
+took.
+"""
+
+import base64
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+_LOG = logging.getLogger(__name__)
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# the API objects of a KatelloConnection that are recorded
+KATELLO_APIS = ['orgapi', 'systemapi', 'userapi', 'envapi', 'rolesapi',
+                'permissionapi', 'distributorapi', 'provapi', 'infoapi']
+
+_ACTIVE = None
+
+
+class CassetteMiss(Exception):
+    """
+    a call was made on replay that the cassette has no (more) answers for
+    """
+    pass
+
+
+class RecordedError(Exception):
+    """
+    replays an error the recorded call raised
+    """
+    pass
+
+
+def _encode(value):
+    """
+    makes a recorded result JSON safe; byte strings that are not text, such
+    as manifest zips, are stored base64 encoded
+    """
+    if isinstance(value, str):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'__base64__': base64.b64encode(value)}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        if '__base64__' in value:
+            raise ValueError("can't record a result with a __base64__ key")
+        return dict((k, _encode(v)) for k, v in value.items())
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if value.keys() == ['__base64__']:
+            return base64.b64decode(value['__base64__'])
+        return dict((k, _decode(v)) for k, v in value.items())
+    return value
+
+
+def _key_default(value):
+    # files (manifest uploads) are matched by position, not content
+    if hasattr(value, 'read'):
+        return '<file>'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return repr(value)
+
+
+def call_key(args, kwargs):
+    return json.dumps([args, kwargs], sort_keys=True, default=_key_default,
+                      separators=(',', ':'))
+
+
+class Cassette(object):
+
+    def __init__(self, path, mode, latency=False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("unknown cassette mode %s" % mode)
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._answers = {}
+        if mode == REPLAY:
+            self.load()
+
+    def load(self):
+        f = open(self.path)
+        try:
+            count = 0
+            for line in f:
+                entry = json.loads(line)
+                self._answers.setdefault((entry['call'], entry['key']), []).append(entry)
+                count += 1
+        finally:
+            f.close()
+        _LOG.info("loaded %s recorded calls from %s" % (count, self.path))
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        # one write per line on an O_APPEND descriptor, so lines from
+        # worker processes don't interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def _replay(self, call, key):
+        self._lock.acquire()
+        try:
+            answers = self._answers.get((call, key))
+            if not answers:
+                raise CassetteMiss("no recorded answer for %s %s" % (call, key))
+            entry = answers.pop(0)
+        finally:
+            self._lock.release()
+        if self.latency:
+            time.sleep(entry['seconds'])
+        if entry.get('error') is not None:
+            raise RecordedError(entry['error'])
+        return _decode(entry['result'])
+
+    def play(self, call, key, func):
+        """
+        returns func()'s result, recording it, or the recorded answer for
+        (call, key) on replay
+        """
+        if self.mode == REPLAY:
+            return self._replay(call, key)
+
+        start = time.time()
+        entry = {'call': call, 'key': key, 'pid': os.getpid()}
+        try:
+            result = func()
+        except Exception, e:
+            entry.update({'seconds': time.time() - start, 'error': str(e)})
+            self._write(entry)
+            raise
+        entry.update({'seconds': time.time() - start, 'result': _encode(result)})
+        self._write(entry)
+        return result
+
+
+class _ApiProxy(object):
+    """
+    stands in for one katello-cli API object, sending every method call
+    through the cassette
+    """
+
+    def __init__(self, tape, name, api):
+        self._tape = tape
+        self._name = name
+        self._api = api
+
+    def __getattr__(self, attr):
+        value = getattr(self._api, attr)
+        if not callable(value):
+            return value
+        call = "%s.%s" % (self._name, attr)
+
+        def wrapper(*args, **kwargs):
+            return self._tape.play(call, call_key(args, kwargs),
+                                   lambda: value(*args, **kwargs))
+        return wrapper
+
+
+def install(path, mode, latency=False):
+    """
+    starts recording to or replaying from the cassette at path, for this
+    process and any it forks from now on
+    """
+    global _ACTIVE
+    if mode == RECORD and os.path.exists(path):
+        os.remove(path)
+    _ACTIVE = Cassette(path, mode, latency)
+    _LOG.info("%s katello and splice traffic %s %s" %
+              (mode == RECORD and "recording" or "replaying",
+               mode == RECORD and "to" or "from", path))
+    return _ACTIVE
+
+
+def uninstall():
+    global _ACTIVE
+    _ACTIVE = None
+
+
+def active():
+    return _ACTIVE
+
+
+def wrap_katello(connection):
+    """
+    puts the API objects of a KatelloConnection behind the active cassette
+    """
+    if _ACTIVE is None:
+        return
+    for name in KATELLO_APIS:
+        api = getattr(connection, name, None)
+        if api is not None and not isinstance(api, _ApiProxy):
+            setattr(connection, name, _ApiProxy(_ACTIVE, name, api))
@@ -12,6 +12,7 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 
 from datetime import datetime
+import hashlib
 import io
 import json
 import logging
@@ -22,13 +23,17 @@ import socket
 import sys
 import tempfile
 import time
+from multiprocessing.pool import ThreadPool
 
 from certutils import certutils
+import dateutil.parser
 from dateutil.tz import tzutc
-from splice.common.connect import BaseConnection
 import splice.common.utils
 
-from spacewalk_splice_tool import facts, connect, utils, constants
+from spacewalk_splice_tool import facts, connect, utils, constants, state, spool, metrics
+from spacewalk_splice_tool import cassette, records, pipeline
+from spacewalk_splice_tool import katello_connect
+from spacewalk_splice_tool.connect import BaseConnection
 from spacewalk_splice_tool.sw_client import SpacewalkClient
 from spacewalk_splice_tool.katello_connect import KatelloConnection, NotFoundException
 
@@ -41,38 +46,97 @@ from subscription_manager.certdirectory import CertificateDirectory
 
 _LOG = logging.getLogger(__name__)
 CONFIG = None
+# timings for the current run, replaced by main()
+METRICS = metrics.RunMetrics()
 
 SAT_OWNER_PREFIX = 'satellite-'
 
+# (bundle key, SpacewalkClient method) for each report a spacewalk sync needs
+SPACEWALK_REPORTS = [('users', 'get_user_list'),
+                     ('systems', 'get_system_list'),
+                     ('channels', 'get_channel_list'),
+                     ('hosts_guests', 'get_host_guest_list'),
+                     ('orgs', 'get_org_list')]
+
+DEFAULT_STATE_DIR = "/var/lib/spacewalk-splice-tool"
+
+# most stale consumers removed from katello in one run
+DEFAULT_MAX_DELETIONS = 500
+
+# systems handed to a fact translation worker at a time
+FACT_CHUNK_SIZE = 500
+
 CERT_DIR_PATH = "/usr/share/rhsm/product/RHEL-6/"
 CERT_DIR = None
+PRODUCT_INDEX = None
 
-def get_product_ids(subscribedchannels):
+
+class ProductIndex(object):
+    """
+    Maps a system's software_channel string to the installed product list
+    candlepin expects. The channel mapping is read once and results are
+    memoized per channel string, since most systems share a handful of
+    channel combinations.
     """
-    For the subscribed base and child channels look up product ids
+
+    def __init__(self, channel_mappings, cert_dir):
+        self.channel_mappings = channel_mappings
+        self.cert_dir = cert_dir
+        # product id -> installed product entry
+        self._products = {}
+        # software_channel -> installed product list
+        self._installed = {}
+
+    def _product(self, product_id):
+        if product_id not in self._products:
+            product_cert = self.cert_dir.findByProduct(str(product_id))
+            self._products[product_id] = {"productId": product_cert.products[0].id,
+                                          "productName": product_cert.products[0].name}
+        return self._products[product_id]
+
+    def installed_products(self, subscribedchannels):
+        if subscribedchannels not in self._installed:
+            product_ids = []
+            for channel in subscribedchannels.split(';'):
+                if channel in self.channel_mappings:
+                    cert = self.channel_mappings[channel]
+                    product_ids.append(cert.split('-')[-1].split('.')[0])
+            # reformat to how candlepin expects the product id list
+            self._installed[subscribedchannels] = map(self._product, product_ids)
+        return self._installed[subscribedchannels]
+
+
+def get_product_index():
     """
-    if CERT_DIR is None:
-        global CERT_DIR
-        CERT_DIR = CertificateDirectory(CERT_DIR_PATH)
+    returns the ProductIndex for this run, building it on first use
+    """
+    global CERT_DIR, PRODUCT_INDEX
+    if PRODUCT_INDEX is None:
+        if CERT_DIR is None:
+            CERT_DIR = CertificateDirectory(CERT_DIR_PATH)
+
+        mapping_file = os.path.join(
+            os.path.join(constants.CHANNEL_PRODUCT_ID_MAPPING_DIR,
+                         utils.get_release()),
+            constants.CHANNEL_PRODUCT_ID_MAPPING_FILE)
+        PRODUCT_INDEX = ProductIndex(utils.read_mapping_file(mapping_file),
+                                     CERT_DIR)
+    return PRODUCT_INDEX
 
-    mapping_file = os.path.join(
-        os.path.join(constants.CHANNEL_PRODUCT_ID_MAPPING_DIR,
-                     utils.get_release()),
-        constants.CHANNEL_PRODUCT_ID_MAPPING_FILE)
-    channel_mappings = utils.read_mapping_file(mapping_file)
 
-    product_ids = []
-    for channel in subscribedchannels.split(';'):
-        origin_channel = channel
-        if origin_channel in channel_mappings:
-            cert = channel_mappings[origin_channel]
-            product_ids.append(cert.split('-')[-1].split('.')[0])
-    # reformat to how candlepin expects the product id list
-    installed_products = []
-    for p in product_ids:
-        product_cert = CERT_DIR.findByProduct(str(p))
-        installed_products.append({"productId": product_cert.products[0].id, "productName": product_cert.products[0].name})
-    return installed_products
+def reset_product_index():
+    global CERT_DIR, PRODUCT_INDEX
+    CERT_DIR = None
+    PRODUCT_INDEX = None
+
+
+def get_product_ids(subscribedchannels):
+    """
+    For the subscribed base and child channels look up product ids. The
+    returned list is shared between systems with the same channels, so
+    callers must not modify it.
+    """
+    return get_product_index().installed_products(subscribedchannels)
 
 
 def get_splice_serv_id():
@@ -103,15 +167,32 @@ def transform_entitlements_to_rcs(entitlements):
 
     return rcs_ents
         
-def _get_splice_server_uuid():
+def _get_splice_server_uuid(cfg):
     """
     obtains the UUID that sst is emulating
     """
-    cfg = get_checkin_config()
     cutils = certutils.CertUtils()
     return cutils.get_subject_pieces(open(cfg["cert"]).read(), ['CN'])['CN']
 
-def transform_to_rcs(consumer):
+
+class SyncContext(object):
+    """
+    Per run data for the splice sync: the checkin config, and the splice
+    server identity, which is parsed from its certificate the first time it
+    is needed instead of once per consumer.
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self._splice_server_uuid = None
+
+    def get_splice_server_uuid(self):
+        if self._splice_server_uuid is None:
+            self._splice_server_uuid = _get_splice_server_uuid(self.cfg)
+        return self._splice_server_uuid
+
+
+def transform_to_rcs(consumer, context):
     """
     convert a katello consumer into something parsable by RCS
     as a MarketingProductUsage obj
@@ -119,7 +200,7 @@ def transform_to_rcs(consumer):
 
     retval = {}
 
-    retval['splice_server'] = _get_splice_server_uuid()
+    retval['splice_server'] = context.get_splice_server_uuid()
     retval['date'] = consumer['checkin_time']
     retval['name'] = consumer['name']
     retval['service_level'] = consumer['serviceLevel']
@@ -135,57 +216,100 @@ def transform_to_rcs(consumer):
     return retval
 
 
+def translate_facts(details):
+    """
+    the subscription manager facts for one system's details. This is the
+    CPU heavy part of building a consumer and runs in the fact_workers
+    processes, if there are any.
+    """
+    facts_data = facts.translate_sw_facts_to_subsmgr(details)
+    # assume 3.1, so large certs can bind to this consumer
+    facts_data['system.certificate_version'] = '3.1'
+    return facts_data
+
+
+def transform_to_consumer(details, facts_data=None):
+    """
+    Convert one system's details to a katello consumer. Note that this is an
+    ersatz consumer that gets processed again later, you cannot pass this
+    directly into katello. facts_data is translate_facts(details), if the
+    caller already has it.
+
+    The consumer is a compact record; its facts are read-only and need a
+    dict() before they are sent anywhere.
+    """
+    if facts_data is None:
+        facts_data = translate_facts(details)
+    consumer = records.Consumer()
+    consumer['id'] = details['server_id']
+    consumer['facts'] = records.Facts(facts_data)
+    consumer['owner'] = details['org_id']
+    consumer['name'] = details['name']
+    consumer['last_checkin'] = details['last_checkin_time']
+    consumer['installed_products'] = details['installed_products']
+    return consumer
+
+
 def transform_to_consumers(system_details):
     """
-    Convert system details to katello consumers. Note that this is an ersatz
-    consumer that gets processed again later, you cannot pass this directly
-    into katello.
+    Convert a list of system details to katello consumers, see
+    transform_to_consumer.
     """
     _LOG.info("Translating system details to katello consumers")
-    consumer_list = []
-    for details in system_details:
-        facts_data = facts.translate_sw_facts_to_subsmgr(details)
-        # assume 3.1, so large certs can bind to this consumer
-        facts_data['system.certificate_version'] = '3.1'
-        consumer = dict()
-        consumer['id'] = details['server_id']
-        consumer['facts'] = facts_data
-        consumer['owner'] = details['org_id']
-        consumer['name'] = details['name']
-        consumer['last_checkin'] = details['last_checkin_time']
-        consumer['installed_products'] = details['installed_products']
+    return map(transform_to_consumer, system_details)
 
-        consumer_list.append(consumer)
-    return consumer_list
 
-
-def build_server_metadata(cfg):
+def stream_consumers(systems, workers=1):
+    """
+    Lazily converts a stream of system details to katello consumers. With
+    more than one worker the facts are translated in a pool of that many
+    processes, FACT_CHUNK_SIZE systems at a time.
+    """
+    if workers <= 1:
+        return pipeline.stage(transform_to_consumer, systems,
+                              'fact_translation', METRICS)
+    _LOG.info("translating facts in %s worker processes" % workers)
+    # the phase is the time the workers spent translating, building the
+    # record from the translated facts is cheap
+    translated = pipeline.process_map(translate_facts, systems, workers,
+                                      FACT_CHUNK_SIZE, 'fact_translation', METRICS)
+    return pipeline.stage(lambda pair: transform_to_consumer(*pair), translated)
+
+
+def build_server_metadata(context):
     """
     Build splice server metadata obj
     """
     _LOG.info("building server metadata")
+    cfg = context.cfg
     server_metadata = {}
     server_metadata['description'] = cfg["splice_server_description"]
     server_metadata['environment'] = cfg["splice_server_environment"]
     server_metadata['hostname'] = cfg["splice_server_hostname"]
-    server_metadata['uuid'] = _get_splice_server_uuid()
+    server_metadata['uuid'] = context.get_splice_server_uuid()
     server_metadata['created'] = datetime.now(tzutc()).isoformat()
     server_metadata['updated'] = server_metadata['created']
     # wrap obj for consumption by upstream rcs
     return {"objects": [server_metadata]}
 
-def get_katello_consumers():
-    katello_conn = KatelloConnection()
-    return katello_conn.getConsumers()
-
-def get_katello_entitlements(uuid):
-    katello_conn = KatelloConnection()
-    return katello_conn.getEntitlements(uuid)
+def harvest_mpu(katello_client, context, consumer_list=None):
+    """
+    yields a MarketingProductUsage record, product info included, for each
+    katello consumer (or each one in consumer_list). Consumer details,
+    status and entitlements all come from a single harvestConsumers pass on
+    one connection.
+    """
+    for consumer in katello_client.harvestConsumers(consumer_list):
+        mpu = transform_to_rcs(consumer, context)
+        mpu['product_info'] = transform_entitlements_to_rcs(consumer['entitlements'])
+        yield mpu
 
-def write_sample_json(sample_json, mpu_data, splice_server_data):
-    def write_file(file_name, data):
-        if not data:
-            return
+def write_sample_json(sample_json, mpu_records, splice_server_data):
+    """
+    write the data sent to splice under the sample_json directory. The MPU
+    records may be any iterable and are written one at a time.
+    """
+    def write_file(file_name, write):
         if not os.path.exists(sample_json):
             _LOG.info("Directory doesn't exist: %s" % (sample_json))
             return
@@ -194,89 +318,164 @@ def write_sample_json(sample_json, mpu_data, splice_server_data):
             _LOG.info("Will write json data to: %s" % (target_path))
             f = open(target_path, "w")
             try:
-                f.write(splice.common.utils.obj_to_json(data, indent = 4))
+                write(f)
             finally:
                 f.close()
         except Exception, e:
             _LOG.exception("Unable to write sample json for: %s" % (target_path))
-    write_file("sst_mpu.json", mpu_data)
-    write_file("sst_splice_server.json", splice_server_data)
 
-def upload_to_rcs(mpu_data, sample_json=None):
-    cfg = get_checkin_config()
+    def write_mpu(f):
+        writer = spool.JsonObjectsWriter(f, indent=4)
+        for record in mpu_records:
+            writer.write(record)
+        writer.close()
+
+    write_file("sst_mpu.json", write_mpu)
+    if splice_server_data:
+        write_file("sst_splice_server.json",
+                   lambda f: f.write(splice.common.utils.obj_to_json(splice_server_data, indent = 4)))
+
+def post_to_rcs(post, url, ok_statuses, retries, retry_delay):
+    """
+    Calls post(), a POST of some data to url, retrying failed attempts.
+    Returns True once the server answers with one of ok_statuses, False if
+    every attempt failed.
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(retry_delay * attempt)
+        try:
+            status, body = post()
+            _LOG.debug("POST to %s: received %s %s" % (url, status, body))
+            if status in ok_statuses:
+                return True
+            _LOG.warning("POST to %s failed with status %s (attempt %s of %s)" %
+                         (url, status, attempt + 1, retries + 1))
+        except Exception, e:
+            _LOG.warning("POST to %s failed: %s (attempt %s of %s)" %
+                         (url, e, attempt + 1, retries + 1))
+    return False
+
+def upload_to_rcs(rcs_spool, context, sample_json=None):
+    """
+    Uploads the splice server metadata and then every chunk waiting in the
+    spool, oldest first. Chunks are streamed from disk rather than loaded.
+    Accepted chunks are removed from the spool; if a chunk can not be
+    uploaded the run ends and the rest are kept for the next one.
+    """
+    cfg = context.cfg
     try:
+        # one kept-alive connection carries the metadata and every chunk
         splice_conn = BaseConnection(cfg["host"], cfg["port"], cfg["handler"],
-            cert_file=cfg["cert"], key_file=cfg["key"], ca_cert=cfg["ca"])
+            cert_file=cfg["cert"], key_file=cfg["key"], ca_cert=cfg["ca"],
+            gzip_body=cfg["gzip"])
 
-        splice_server_data = build_server_metadata(cfg)
+        chunks = rcs_spool.pending()
+        splice_server_data = build_server_metadata(context)
         if sample_json:
-            write_sample_json(sample_json=sample_json, mpu_data=mpu_data,
+            write_sample_json(sample_json=sample_json, mpu_records=rcs_spool.records(),
                             splice_server_data=splice_server_data)
         # upload the server metadata to rcs
         _LOG.info("sending metadata to server")
         url = "/v1/spliceserver/"
-        status, body = splice_conn.POST(url, splice_server_data)
-        _LOG.debug("POST to %s: received %s %s" % (url, status, body))
-        if status != 204:
+        if not post_to_rcs(lambda: splice_conn.POST(url, splice_server_data), url,
+                           [204], cfg["retries"], cfg["retry_delay"]):
             _LOG.error("Splice server metadata was not uploaded correctly")
             utils.system_exit(os.EX_DATAERR, "Error uploading splice server data")
 
         # upload the data to rcs
+        _LOG.info("sending %s chunks of marketing product usage to server" % len(chunks))
         url = "/v1/marketingproductusage/"
-        status, body = splice_conn.POST(url, mpu_data)
-        _LOG.debug("POST to %s: received %s %s" % (url, status, body))
-        if status != 202 and status != 204:
-            _LOG.error("MarketingProductUsage data was not uploaded correctly")
-            utils.system_exit(os.EX_DATAERR, "Error uploading marketing product usage data")
-
-        utils.system_exit(os.EX_OK, "Upload was successful")
+        for done, chunk in enumerate(chunks):
+            chunk_file = open(chunk)
+            try:
+                accepted = post_to_rcs(lambda: splice_conn.POST_file(url, chunk_file), url,
+                                       [202, 204], cfg["retries"], cfg["retry_delay"])
+            finally:
+                chunk_file.close()
+            if not accepted:
+                _LOG.error("MarketingProductUsage data was not uploaded correctly, "
+                           "%s of %s chunks are kept for the next run" % (len(chunks) - done, len(chunks)))
+                utils.system_exit(os.EX_DATAERR, "Error uploading marketing product usage data")
+            rcs_spool.accept(chunk)
+            _LOG.debug("chunk %s accepted" % chunk)
+
+        splice_conn.close()
+        _LOG.info("Upload was successful")
     except Exception, e:
         _LOG.error("Error uploading MarketingProductUsage Data; Error: %s" % e)
         utils.system_exit(os.EX_DATAERR, "Error uploading; Error: %s" % e)
 
+def _open_manifest(manifest_data):
+    """
+    returns a read-only file holding the manifest zip. katello-cli wants a
+    real file object to import, so the data goes through a temp file, but the
+    name is unlinked as soon as it is open and the data goes away when the
+    file is closed, even if the import fails.
+    """
+    fd, path = tempfile.mkstemp(prefix='sst-manifest-', suffix='.zip')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(manifest_data)
+        finally:
+            f.close()
+        return open(path, 'rb')
+    finally:
+        os.unlink(path)
+
+def _provision_owner(katello_client, org_id, org_name):
+    """
+    creates a distributor for a new org in satellite-1 and moves its manifest
+    over. This runs in the katello_connect.run_jobs workers.
+    """
+    _LOG.info("creating distributor for %s (org id: %s)" % (org_name, org_id))
+    distributor = katello_client.createDistributor(name="Distributor for %s" % org_name, root_org='satellite-1')
+    manifest_data = katello_client.exportManifest(dist_uuid = distributor['uuid'])
+    manifest_file = _open_manifest(manifest_data)
+    try:
+        # this uses the org name, not label
+        provider = katello_client.getRedhatProvider(org=org_name)
+        katello_client.importManifest(prov_id=provider['id'], file = manifest_file)
+    finally:
+        manifest_file.close()
+
 def update_owners(katello_client, orgs):
     """
-    ensure that the katello owner set matches what's in spacewalk
+    ensure that the katello owner set matches what's in spacewalk. New orgs
+    get their distributor and manifest set up [katello] provision_workers
+    at a time.
     """
 
     owners = katello_client.getOwners()
     org_ids = orgs.keys()
-    owner_labels = map(lambda x: x['label'], owners)
+    owner_labels = set(owner['label'] for owner in owners)
 
-    for org_id in org_ids:
+    new_org_ids = []
+    for org_id in sorted(org_ids):
         katello_label = SAT_OWNER_PREFIX + org_id
         if katello_label not in owner_labels:
             _LOG.info("creating owner %s (%s), owner is in spacewalk but not katello" % (katello_label, orgs[org_id]))
             katello_client.createOwner(label=katello_label, name=orgs[org_id])
             katello_client.createOrgAdminRolePermission(kt_org_label=katello_label)
-            # if we are not the first org, create a distributor for us in the first org
-            if org_id is not "1":
-                _LOG.info("creating distributor for %s (org id: %s)" % (orgs[org_id], org_id)) 
-                distributor = katello_client.createDistributor(name="Distributor for %s" % orgs[org_id], root_org='satellite-1')
-                manifest_data = katello_client.exportManifest(dist_uuid = distributor['uuid'])
-                # katello-cli does some magic that requires an actual file here
-                manifest_file = tempfile.NamedTemporaryFile(suffix='.zip', delete=False)
-                manifest_filename = manifest_file.name
-                _LOG.info("manifest temp file is %s" % manifest_filename)
-                manifest_file.write(manifest_data)
-                manifest_file.close()
-                manifest_file = open(manifest_filename, 'r')
-        
-                # this uses the org name, not label
-                provider = katello_client.getRedhatProvider(org=orgs[org_id])
-                katello_client.importManifest(prov_id=provider['id'], file = manifest_file)
-                # explicit close to make sure the temp file gets deleted
-                manifest_file.close()
-
-    # get the owner list again
-    owners = katello_client.getOwners()
-    # build up a label->name mapping this time
-    owner_labels_names = {}
+            new_org_ids.append(org_id)
+
+    # if we are not the first org, create a distributor for us in the first
+    # org. All the owners exist by now, including satellite-1 if it is new.
+    jobs = [(org_id, orgs[org_id]) for org_id in new_org_ids if org_id != "1"]
+    workers = utils.cfg_getint(CONFIG, 'katello', 'provision_workers', 1)
+    failed = 0
+    for args, ok, result in katello_connect.run_jobs(_provision_owner, jobs, workers,
+                                                     katello_client):
+        if not ok:
+            failed += 1
+    if failed:
+        _LOG.error("%s new orgs could not get a manifest" % failed)
+
+    # perform deletions. Owners created above are all in spacewalk, so the
+    # listing from the start of the sync is enough.
     for owner in owners:
-        owner_labels_names[owner['label']] = owner['name']
-
-    # perform deletions
-    for owner_label in owner_labels_names.keys():
+        owner_label = owner['label']
         # bail out if this isn't an owner we are managing
         if not owner_label.startswith(SAT_OWNER_PREFIX):
             continue
@@ -284,13 +483,15 @@ def update_owners(katello_client, orgs):
         # get the org ID from the katello name
         kt_org_id = owner_label[len(SAT_OWNER_PREFIX):]
         if kt_org_id not in org_ids:
-            _LOG.info("removing owner %s (name: %s), owner is no longer in spacewalk" % (owner_label, owner_labels_names[owner_label]))
-            katello_client.deleteOwner(name=owner_labels_names[owner_label])
+            _LOG.info("removing owner %s (name: %s), owner is no longer in spacewalk" % (owner_label, owner['name']))
+            katello_client.deleteOwner(name=owner['name'])
             
 
 def update_users(katello_client, sw_userlist):
     """
-    ensure that the katello user set matches what's in spacewalk
+    ensure that the katello user set matches what's in spacewalk. Returns
+    the katello users by username, including any that were just created, so
+    update_roles does not have to list them again.
     """
 
     sw_users = {}
@@ -301,79 +502,137 @@ def update_users(katello_client, sw_userlist):
         kt_users[kt_user['username']] = kt_user
 
     for sw_username in sw_users.keys():
-        if sw_username not in kt_users.keys():
+        if sw_username not in kt_users:
             _LOG.info("adding new user %s to katello" % sw_username)
-            created_kt_user = katello_client.createUser(username=sw_username, email=sw_users[sw_username]['email']) 
+            created_kt_user = katello_client.createUser(username=sw_username, email=sw_users[sw_username]['email'])
+            kt_users[sw_username] = created_kt_user
+    return kt_users
+
+def get_role_memberships(katello_client, kt_users):
+    """
+    returns a dict of katello user id -> set of role names for the given
+    users, from one getRoles call per user. Katello's role API has no way
+    to list the users in a role (neither the role listing nor a single role
+    carries them), so the memberships can't be read per role instead.
+    """
+    memberships = {}
+    for kt_user in kt_users:
+        memberships[kt_user['id']] = set(role['name'] for role in
+                                         katello_client.getRoles(user_id=kt_user['id']))
+    return memberships
 
-def update_roles(katello_client, sw_userlist):
+def update_roles(katello_client, sw_userlist, kt_users=None):
+    """
+    ensure that each user's org admin and full admin roles in katello match
+    their spacewalk roles. kt_users is the username -> user dict from
+    update_users; katello is asked for it if it is not given.
+
+    Role memberships are loaded up front for the users that are also in
+    spacewalk, one call per user, and only the grants and revokes that are
+    actually needed are sent.
+    """
     sw_users = {}
     for sw_user in sw_userlist:
         sw_users[sw_user['username']] = sw_user
-    kt_users = {}
-    for kt_user in katello_client.getUsers():
-        kt_users[kt_user['username']] = kt_user
+    if kt_users is None:
+        kt_users = {}
+        for kt_user in katello_client.getUsers():
+            kt_users[kt_user['username']] = kt_user
 
-    for kt_username in kt_users.keys():
+    synced_users = []
+    for kt_username in sorted(kt_users.keys()):
         # if the user isn't also in SW, bail out
         # NB: we assume kt_users is always be a superset of sw_users
-        if kt_username not in sw_users.keys():
+        if kt_username not in sw_users:
             _LOG.info("skipping role sync for %s, user is not in spacewalk" % kt_username)
             continue
+        synced_users.append(kt_users[kt_username])
+
+    memberships = get_role_memberships(katello_client, synced_users)
+
+    for kt_user in synced_users:
+        sw_user = sw_users[kt_user['username']]
+        sw_roles = sw_user['role'].split(';')
+        kt_org_label = "%s%s" % (SAT_OWNER_PREFIX, sw_user['organization_id'])
+        org_admin_role = "Org Admin Role for %s" % kt_org_label
+
+        # the only roles we manage are the org admin role for the user's own
+        # org and the full admin role
+        wanted = set()
+        if 'Organization Administrator' in sw_roles:
+            wanted.add(org_admin_role)
+        if 'Satellite Administrator' in sw_roles:
+            wanted.add('Administrator')
+        current = memberships[kt_user['id']] & set([org_admin_role, 'Administrator'])
+        _LOG.debug("roles for %s: katello has %s, spacewalk wants %s" %
+                   (kt_user['username'], sorted(current), sorted(wanted)))
+
+        if org_admin_role in wanted - current:
+            _LOG.info("adding %s to %s org admin role in katello" % (kt_user['username'], kt_org_label))
+            katello_client.grantOrgAdmin(kt_user=kt_user, kt_org_label=kt_org_label)
+        if 'Administrator' in wanted - current:
+            _LOG.info("adding %s to full admin role in katello" % kt_user['username'])
+            katello_client.grantFullAdmin(kt_user=kt_user)
+        if org_admin_role in current - wanted:
+            _LOG.info("removing %s from %s org admin role in katello" % (kt_user['username'], kt_org_label))
+            katello_client.ungrantOrgAdmin(kt_user=kt_user, kt_org_label=kt_org_label)
+        if 'Administrator' in current - wanted:
+            _LOG.info("removing %s from full admin role in katello" % kt_user['username'])
+            katello_client.ungrantFullAdmin(kt_user=kt_user)
+
+
+def _delete_consumer(katello_client, consumer_uuid):
+    """
+    removes one consumer, run in the katello_connect.run_jobs workers
+    """
+    katello_client.deleteConsumer(consumer_uuid)
+
+def delete_stale_consumers(katello_client, consumer_list, system_ids):
+    """
+    removes consumers that are in katello and not spacewalk, i.e. whose
+    systemid is not one of the spacewalk server ids in system_ids. This is
+    to clean up any systems that were deleted in spacewalk.
+
+    Deletes run [katello] delete_workers at a time. At most [katello]
+    max_deletions consumers (default DEFAULT_MAX_DELETIONS, 0 for no limit)
+    are removed per run and the rest are left for the next one, so a bad
+    spacewalk report can't wipe out a whole org in one go. Nothing is
+    removed if spacewalk reported no systems at all.
+    """
+
+    system_ids = set(system_ids)
+
+    managed = [consumer for consumer in consumer_list
+               # don't delete consumers that are not in orgs we manage!
+               if consumer['owner']['key'].startswith(SAT_OWNER_PREFIX)]
+    if managed and not system_ids:
+        _LOG.error("spacewalk reported no systems, not removing any of the %s "
+                   "consumers in katello" % len(managed))
+        return
+
+    consumers_to_delete = [consumer for consumer in managed
+                           if consumer['facts']['systemid'] not in system_ids]
 
-        # get a flat list of role names, for comparison with sw
-        kt_roles = map(lambda x: x['name'], katello_client.getRoles(user_id = kt_users[kt_username]['id']))
-        sw_roles = sw_users[kt_username]['role'].split(';')
-        sw_user_org = sw_users[kt_username]['organization_id']
-
-
-        # add any new roles
-        for sw_role in sw_roles:
-            _LOG.debug("examining sw role %s for org %s against kt role set %s" % (sw_role, sw_user_org,  kt_roles))
-            if sw_role == 'Organization Administrator' and \
-                "Org Admin Role for satellite-%s" % sw_user_org not in kt_roles:
-                    _LOG.info("adding %s to %s org admin role in katello" % (kt_username, "satellite-%s" % sw_user_org))
-                    katello_client.grantOrgAdmin(
-                        kt_user=kt_users[kt_username], kt_org_label = "satellite-%s" % sw_user_org)
-            elif sw_role == 'Satellite Administrator' and 'Administrator' not in kt_roles:
-                    _LOG.info("adding %s to full admin role in katello" % kt_username)
-                    katello_client.grantFullAdmin(kt_user=kt_users[kt_username])
-
-        # delete any roles in kt but not sw
-        for kt_role in kt_roles:
-            # TODO: handle sat admin
-            _LOG.debug("examining kt role %s against sw role set %s for org %s" % (kt_role, sw_roles, sw_user_org))
-            if kt_role == "Org Admin Role for satellite-%s" % sw_users[kt_username]['organization_id'] and \
-                "Organization Administrator" not in sw_roles:
-                _LOG.info("removing %s from %s org admin role in katello" % (kt_username, "satellite-%s" % sw_user_org))
-                katello_client.ungrantOrgAdmin(kt_user=kt_users[kt_username],
-                                kt_org_label = "satellite-%s" % sw_user_org)
-            elif kt_role == 'Administrator' and sw_role != 'Satellite Administrator':
-                    _LOG.info("removing %s from full admin role in katello" % kt_username)
-                    katello_client.ungrantFullAdmin(kt_user=kt_users[kt_username])
-                
-
-def delete_stale_consumers(katello_client, consumer_list, system_list):
-    """
-    removes consumers that are in katello and not spacewalk. This is to clean
-    up any systems that were deleted in spacewalk.
-    """
-
-    system_id_list = map(lambda x: x['server_id'], system_list)
-
-    _LOG.debug("system id list from sw: %s" % system_id_list)
-    consumers_to_delete = []
-    for consumer in consumer_list:
-        _LOG.debug("checking %s for deletion" % consumer['facts']['systemid'])
-        # don't delete consumers that are not in orgs we manage!
-        if not consumer['owner']['key'].startswith(SAT_OWNER_PREFIX):
-            continue
-        if consumer['facts']['systemid'] not in system_id_list:
-            consumers_to_delete.append(consumer)
-    
     _LOG.info("removing %s consumers that are no longer in spacewalk" % len(consumers_to_delete))
-    for consumer in consumers_to_delete:
-        _LOG.info("removed consumer %s" % consumer['name'])
-        katello_client.deleteConsumer(consumer['uuid'])
+    max_deletions = utils.cfg_getint(CONFIG, 'katello', 'max_deletions',
+                                     DEFAULT_MAX_DELETIONS)
+    if max_deletions and len(consumers_to_delete) > max_deletions:
+        _LOG.warning("only removing %s of %s stale consumers this run, see "
+                     "[katello] max_deletions" % (max_deletions, len(consumers_to_delete)))
+        consumers_to_delete = consumers_to_delete[:max_deletions]
+
+    workers = utils.cfg_getint(CONFIG, 'katello', 'delete_workers', 1)
+    names = dict((consumer['uuid'], consumer['name']) for consumer in consumers_to_delete)
+    jobs = [(consumer['uuid'],) for consumer in consumers_to_delete]
+    failed = 0
+    for args, ok, result in katello_connect.run_jobs(_delete_consumer, jobs, workers,
+                                                     katello_client):
+        if ok:
+            _LOG.info("removed consumer %s" % names[args[0]])
+        else:
+            failed += 1
+    if failed:
+        _LOG.error("%s stale consumers could not be removed" % failed)
 
 def upload_host_guest_mapping(host_guests, katello_client):
     """
@@ -382,39 +641,128 @@ def upload_host_guest_mapping(host_guests, katello_client):
     """
     pass
 
-def upload_to_katello(consumers, katello_client):
+def consumer_fingerprint(consumer):
+    """
+    hash of the consumer data we send to katello, used to spot systems that
+    have not changed since the last run
+    """
+    data = [consumer['name'], consumer['last_checkin'], dict(consumer['facts']),
+            consumer['installed_products']]
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+
+def get_state_store(name):
+    state_dir = utils.cfg_get(CONFIG, 'main', 'state_dir', DEFAULT_STATE_DIR)
+    return state.StateStore(os.path.join(state_dir, name))
+
+
+def get_rcs_spool():
+    state_dir = utils.cfg_get(CONFIG, 'main', 'state_dir', DEFAULT_STATE_DIR)
+    return spool.ChunkSpool(os.path.join(state_dir, 'rcs_spool'))
+
+
+def _upload_consumer(katello_client, consumer, cp_uuid, spacewalk_host, lookup=False):
+    """
+    create or update one consumer, returning its katello uuid. This runs in
+    the katello_connect.run_jobs workers. With lookup set, the consumer's
+    uuid was not in the katello listing and is looked up by spacewalk id
+    first.
+    """
+    if lookup:
+        found = katello_client.findBySpacewalkID("satellite-%s" % consumer['owner'], consumer['id'])
+        if found:
+            cp_uuid = found[0]['uuid']
+    if cp_uuid:
+        katello_client.updateConsumer(cp_uuid=cp_uuid,
+                                      sw_id = consumer['id'],
+                                      name = consumer['name'],
+                                      facts=dict(consumer['facts']),
+                                      installed_products=consumer['installed_products'],
+                                      owner=consumer['owner'],
+                                      last_checkin=consumer['last_checkin'])
+        return cp_uuid
+    return katello_client.createConsumer(name=consumer['name'],
+                                         sw_uuid=consumer['id'],
+                                         facts=dict(consumer['facts']),
+                                         installed_products=consumer['installed_products'],
+                                         last_checkin=consumer['last_checkin'],
+                                         owner=consumer['owner'],
+                                         spacewalk_server_hostname=spacewalk_host)
+
+
+def upload_to_katello(consumers, katello_client, consumer_state=None,
+                      katello_consumer_list=None):
     """
-    Uploads consumer data to katello
+    Uploads consumer data to katello, using [katello] upload_workers
+    processes at once. If a StateStore is given, consumers whose uuid and
+    fingerprint match what the last run uploaded are skipped, and the store
+    is updated and saved as consumers are written. Returns a list of
+    (spacewalk id, error) for consumers that failed to upload.
+
+    A consumer's uuid comes from katello_consumer_list, the detailed listing
+    from getConsumers(), whose facts carry the spacewalk id. Without it the
+    plain listing is used, which has uuids but not spacewalk ids, so the
+    uuid comes from the store if that uuid is still in katello, else from a
+    findBySpacewalkID call in the worker.
     """
 
-    # TODO: this can go away and be refactored to use findBySpacewalkID within
-    # the loop
-    consumers_from_kt = katello_client.getConsumers(with_details=False)
-    names_to_uuids = {}
-    for consumer in consumers_from_kt:
-        names_to_uuids[consumer['name']] = consumer['uuid']
+    index = katello_client.getSpacewalkIDIndex(katello_consumer_list)
+    spacewalk_host = CONFIG.get('spacewalk', 'host')
+    workers = utils.cfg_getint(CONFIG, 'katello', 'upload_workers', 1)
+
+    counts = {'skipped': 0}
+    seen = set()
+    # spacewalk id -> fingerprint of the consumers handed to the workers
+    fingerprints = {}
+
+    def jobs():
+        for consumer in consumers:
+            seen.add(consumer['id'])
+            cp_uuid, resolved = index.lookup("satellite-%s" % consumer['owner'], consumer['id'])
+            if cp_uuid is None and consumer_state is not None:
+                known = consumer_state.get(consumer['id'])
+                if known and known[0] in index.uuids:
+                    cp_uuid, resolved = known[0], True
+            if consumer_state is not None:
+                fingerprint = consumer_fingerprint(consumer)
+                if cp_uuid and consumer_state.get(consumer['id']) == [cp_uuid, fingerprint]:
+                    counts['skipped'] += 1
+                    continue
+                fingerprints[consumer['id']] = fingerprint
+            yield (consumer, cp_uuid, spacewalk_host, not resolved)
 
     done = 0
-    for consumer in consumers:
-        if (done % 10) == 0:
-            _LOG.info("%s consumers uploaded so far." % done)
-        if katello_client.findBySpacewalkID("satellite-%s" % consumer['owner'], consumer['id']):
-            katello_client.updateConsumer(cp_uuid=names_to_uuids[consumer['name']],
-                                          sw_id = consumer['id'],
-                                          name = consumer['name'],
-                                          facts=consumer['facts'],
-                                          installed_products=consumer['installed_products'],
-                                          owner=consumer['owner'],
-                                          last_checkin=consumer['last_checkin'])
-        else:
-            uuid = katello_client.createConsumer(name=consumer['name'],
-                                                sw_uuid=consumer['id'],
-                                                facts=consumer['facts'],
-                                                installed_products=consumer['installed_products'],
-                                                last_checkin=consumer['last_checkin'],
-                                                owner=consumer['owner'],
-                                                spacewalk_server_hostname=CONFIG.get('spacewalk', 'host'))
-        done += 1
+    failures = []
+    try:
+        for args, ok, result in katello_connect.run_jobs(_upload_consumer, jobs(),
+                                                         workers, katello_client):
+            consumer = args[0]
+            fingerprint = fingerprints.pop(consumer['id'], None)
+            if not ok:
+                failures.append((consumer['id'], result))
+                continue
+            if consumer_state is not None:
+                consumer_state.set(consumer['id'], [result, fingerprint])
+            done += 1
+            if (done % 10) == 0:
+                _LOG.info("%s consumers uploaded so far." % done)
+
+        if consumer_state is not None:
+            # forget systems that are gone from spacewalk
+            for sw_id in consumer_state.keys():
+                if sw_id not in seen:
+                    consumer_state.delete(sw_id)
+    finally:
+        if consumer_state is not None:
+            consumer_state.save()
+
+    _LOG.info("%s consumers uploaded, %s unchanged since the last run" % (done, counts['skipped']))
+    if failures:
+        _LOG.error("%s consumers failed to upload to katello" % len(failures))
+        for sw_id, error in failures:
+            _LOG.error("failed to upload spacewalk system %s: %s" % (sw_id, error))
+    return failures
+
 
 def get_checkin_config():
     return {
@@ -427,6 +775,9 @@ def get_checkin_config():
         "splice_server_environment" : CONFIG.get("splice", "splice_server_environment"),
         "splice_server_hostname" : CONFIG.get("splice", "splice_server_hostname"),
         "splice_server_description" : CONFIG.get("splice", "splice_server_description"),
+        "retries" : utils.cfg_getint(CONFIG, "splice", "upload_retries", 3),
+        "retry_delay" : utils.cfg_getint(CONFIG, "splice", "upload_retry_delay", 10),
+        "gzip" : utils.cfg_getboolean(CONFIG, "splice", "gzip_upload", False),
     }
 
 def build_rcs_data(data):
@@ -436,120 +787,320 @@ def build_rcs_data(data):
     return {"objects": data}
 
 
-def get_parent_channel(channel, channels):
-    for c in channels:
-        if c['new_channel_label'] == channel['original_channel_label']:
-            return get_parent_channel(c, channels)
-    return channel
-    
-
 def channel_mapping(channels):
-    channel_map = {}
-
+    """
+    Map every cloned channel label to the label of the channel at the root
+    of its clone chain. Channels are indexed by label and each chain is
+    walked once, with every label on it memoized, so this is linear in the
+    number of channels. A cyclic clone graph is logged; channels on the cycle
+    are mapped one level up, to their immediate original, and clones of
+    them follow that mapping.
+    """
+    clones = {}
     for channel in channels:
-        parent_channel = get_parent_channel(channel, channels)
-        channel_map[channel['new_channel_label']] = \
-            parent_channel['original_channel_label']
+        # the first entry wins, as with the old linear scan
+        clones.setdefault(channel['new_channel_label'], channel)
+
+    channel_map = {}
+    for label in clones:
+        path = []
+        on_path = set()
+        current = label
+        while current in clones and current not in channel_map:
+            if current in on_path:
+                _LOG.warning("cloned channel cycle found at %s, mapping "
+                             "channels in it to their immediate original" % current)
+                cycle_start = path.index(current)
+                for p in path[cycle_start:]:
+                    channel_map[p] = clones[p]['original_channel_label']
+                for p in path[:cycle_start]:
+                    channel_map[p] = channel_map[current]
+                break
+            path.append(current)
+            on_path.add(current)
+            current = clones[current]['original_channel_label']
+        else:
+            root = channel_map.get(current, current)
+            for p in path:
+                channel_map[p] = root
 
     return channel_map
 
 
+def resolve_channel(system, channel_map):
+    """
+    points a system at the original of its cloned channel, see
+    channel_mapping
+    """
+    system['software_channel'] = channel_map.get(system['software_channel'],
+                                                 system['software_channel'])
+    return system
+
+
 def update_system_channel(systems, channels):
 
     _LOG.info("calculating base channels from cloned channels")
     channel_map = channel_mapping(channels)
     for system in systems:
-        system['software_channel'] = channel_map.get(
-                                        system['software_channel'],
-                                        system['software_channel'])
+        resolve_channel(system, channel_map)
+
+
+def add_installed_products(system):
+    """
+    enriches a system with the engineering product ids of its channels
+    """
+    system['installed_products'] = get_product_ids(system['software_channel'])
+    return system
+
+
+def fetch_spacewalk_data(client, workers=1, reports=SPACEWALK_REPORTS):
+    """
+    Runs the spacewalk reports, up to `workers` at a time, and returns a
+    dict keyed by their names. reports is a list of (name, SpacewalkClient
+    method) pairs and defaults to SPACEWALK_REPORTS. The time each report
+    took is logged and returned in the 'timings' key.
+    """
+    def fetch(report):
+        name, method = report
+        start = time.time()
+        result = getattr(client, method)()
+        return name, result, time.time() - start
+
+    workers = max(1, min(workers, len(reports)))
+    if workers == 1:
+        results = map(fetch, reports)
+    else:
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(fetch, reports)
+        finally:
+            pool.close()
+            pool.join()
+
+    data = {'timings': {}}
+    for name, result, elapsed in results:
+        _LOG.info("fetched %s report in %.2f seconds" % (name, elapsed))
+        data[name] = result
+        data['timings'][name] = elapsed
+    return data
 
 
 def spacewalk_sync(options):
     """
-    Performs the data capture, translation and checkin to katello
+    Performs the data capture, translation and checkin to katello.
+
+    The small reports are fetched whole first. The systems report is then
+    streamed through channel resolution, product enrichment and fact
+    translation straight into the katello upload, so uploads start while
+    the report is still being read and only [spacewalk] stream_buffer
+    systems are held at a time.
     """
     _LOG.info("Started capturing system data from spacewalk")
     client = SpacewalkClient(CONFIG.get('spacewalk', 'host'),
                              CONFIG.get('spacewalk', 'ssh_key_path'))
-    katello_client = KatelloConnection()
-    consumers = []
-
-    _LOG.info("retrieving data from spacewalk")
-    sw_user_list = client.get_user_list()
-    system_details = client.get_system_list()
-    channel_details = client.get_channel_list()
-    hosts_guests = client.get_host_guest_list()
-    update_system_channel(system_details, channel_details)
-    org_list = client.get_org_list()
-
-    update_owners(katello_client, org_list)
-    update_users(katello_client, sw_user_list)
-    update_roles(katello_client, sw_user_list)
-
-    katello_consumer_list = katello_client.getConsumers()
-    delete_stale_consumers(katello_client, katello_consumer_list, system_details)
-
-    _LOG.info("adding installed products to %s spacewalk records" % len(system_details))
-    # enrich with engineering product IDs
-    clone_mapping = []
-    map(lambda details :
-            details.update({'installed_products' : \
-                            get_product_ids(details['software_channel'])}),
-                           system_details)
-
-    # convert the system details to katello consumers
-    consumers.extend(transform_to_consumers(system_details))
-    _LOG.info("found %s systems to upload into katello" % len(consumers))
-    _LOG.info("uploading to katello...")
-    upload_to_katello(consumers, katello_client)
+    reset_product_index()
+    # all reports share one multiplexed ssh session for the run
+    client.connect()
+    try:
+        katello_client = KatelloConnection()
+
+        _LOG.info("retrieving data from spacewalk")
+        reports = [report for report in SPACEWALK_REPORTS if report[0] != 'systems']
+        with METRICS.phase('report_fetch'):
+            sw_data = fetch_spacewalk_data(client,
+                        utils.cfg_getint(CONFIG, 'spacewalk', 'report_workers', 5),
+                        reports)
+        for name, elapsed in sw_data['timings'].items():
+            METRICS.add('report_%s' % name, elapsed, len(sw_data[name]))
+        sw_user_list = sw_data['users']
+        org_list = sw_data['orgs']
+
+        with METRICS.phase('owner_sync', len(org_list)):
+            update_owners(katello_client, org_list)
+        with METRICS.phase('user_sync', len(sw_user_list)):
+            kt_users = update_users(katello_client, sw_user_list)
+        with METRICS.phase('role_sync', len(sw_user_list)):
+            update_roles(katello_client, sw_user_list, kt_users)
+
+        _LOG.info("calculating base channels from cloned channels")
+        channel_map = channel_mapping(sw_data['channels'])
+        system_ids = set()
+
+        def collect_id(system):
+            system_ids.add(system['server_id'])
+            return system
+
+        # the detailed listing maps spacewalk ids to the uuids the upload
+        # needs, and tells the stale deletion what katello has
+        with METRICS.phase('katello_listing') as phase:
+            katello_consumer_list = katello_client.getConsumers()
+            phase.items = len(katello_consumer_list)
+
+        _LOG.info("streaming spacewalk systems to katello...")
+        with METRICS.phase('katello_upload') as phase:
+            systems = pipeline.buffered(client.iter_system_list(),
+                        utils.cfg_getint(CONFIG, 'spacewalk', 'stream_buffer', 1000))
+            systems = pipeline.stage(collect_id, systems)
+            systems = pipeline.stage(lambda system: resolve_channel(system, channel_map),
+                                     systems, 'channel_resolution', METRICS)
+            systems = pipeline.stage(add_installed_products, systems,
+                                     'product_enrichment', METRICS)
+            consumers = stream_consumers(systems,
+                            utils.cfg_getint(CONFIG, 'main', 'fact_workers', 1))
+            try:
+                upload_to_katello(consumers, katello_client,
+                                  get_state_store('katello_consumers.json'),
+                                  katello_consumer_list)
+            finally:
+                # stops the report stream if the upload gave up early
+                consumers.close()
+            phase.items = len(system_ids)
+        _LOG.info("%s spacewalk systems synced to katello" % len(system_ids))
+
+        # only once the whole report has been read do we know which
+        # consumers are gone from spacewalk. Consumers created by this run
+        # are missing from the listing, but they are in system_ids anyway.
+        with METRICS.phase('stale_deletion') as phase:
+            delete_stale_consumers(katello_client, katello_consumer_list, system_ids)
+            phase.items = len(katello_consumer_list)
+    finally:
+        client.close()
+
     _LOG.info("upload completed")#. updating with guest info..")
 #    consumer_list = katello_client.getConsumers(with_details=False)
 #    upload_host_guest_mapping(consumer_list, katello_client)
 #    _LOG.info("guest upload completed")
 
 
+def consumer_change_time(consumer):
+    """
+    a katello consumer's updated_at from the systems listing, as a UTC ISO
+    8601 string that sorts by time, or None if it has none.
+
+    The listing has no checkin time, so a checkin alone does not count as a
+    change. A system spacewalk_sync uploaded again (its spacewalk checkin
+    time is part of the fingerprint) has a new updated_at. Anything else
+    only reaches splice with the next full sync.
+    """
+    if not consumer.get('updated_at'):
+        return None
+    return dateutil.parser.parse(consumer['updated_at']).astimezone(tzutc()).isoformat()
+
+
 def splice_sync(options):
     """
-    Syncs data from katello to splice
+    Syncs data from katello to splice. Only consumers that changed since
+    the high water mark of the last run are sent, unless --full-sync is
+    given or the last full run is more than [splice] full_sync_hours old.
+    Usage data is spooled before it is uploaded, and chunks left over from
+    a failed run are sent first.
     """
     _LOG.info("Started syncing system data to splice")
+    sync_state = get_state_store('splice_sync.json')
+    high_water_mark = sync_state.get('high_water_mark')
+    full_sync_hours = utils.cfg_getint(CONFIG, 'splice', 'full_sync_hours', 24)
+    last_full_sync = sync_state.get('last_full_sync') or 0
+    full_sync = options.full_sync or high_water_mark is None or \
+        time.time() - last_full_sync > full_sync_hours * 3600
+
     # now pull put out of katello, and into rcs!
-    katello_consumers = get_katello_consumers()
     katello_client = KatelloConnection()
-    _LOG.info("calculating marketing product usage")
-
-    # create the base marketing usage list
-    rcs_mkt_usage = map(transform_to_rcs, katello_consumers)
-
-    # enrich with product usage info
-    map(lambda rmu : 
-            rmu.update(
-                {'product_info': transform_entitlements_to_rcs(
-                                    get_katello_entitlements(
-                                        rmu['instance_identifier']))}), 
-                                        rcs_mkt_usage)
+    with METRICS.phase('consumer_listing') as phase:
+        consumer_list = katello_client.getConsumers(with_details=False)
+        phase.items = len(consumer_list)
+    change_times = map(consumer_change_time, consumer_list)
+    if full_sync:
+        _LOG.info("performing a full sync of %s consumers" % len(consumer_list))
+    else:
+        # consumers without timestamps are always sent
+        consumer_list = [c for c, t in zip(consumer_list, change_times)
+                         if t is None or t > high_water_mark]
+        _LOG.info("%s consumers changed since %s" % (len(consumer_list), high_water_mark))
+
+    context = SyncContext(get_checkin_config())
+    rcs_spool = get_rcs_spool()
+    if consumer_list:
+        # records are spooled as they are harvested, so only one is held in
+        # memory at a time
+        _LOG.info("calculating marketing product usage")
+        with METRICS.phase('mpu_harvest', len(consumer_list)):
+            rcs_spool.add(harvest_mpu(katello_client, context, consumer_list),
+                          utils.cfg_getint(CONFIG, 'splice', 'upload_chunk_size', 1000))
+
+        # once spooled the data will reach rcs, on this run or a later one,
+        # so the mark can move. It comes from the listing taken before the
+        # harvest, so anything that changes while we run is picked up next
+        # time.
+        known_times = filter(None, change_times)
+        if known_times:
+            sync_state.set('high_water_mark', max(known_times + filter(None, [high_water_mark])))
+        if full_sync:
+            sync_state.set('last_full_sync', time.time())
+        sync_state.save()
+
+    if not rcs_spool.pending():
+        _LOG.info("nothing to upload to splice")
+        return
+
     _LOG.info("uploading to splice...")
-    upload_to_rcs(mpu_data=build_rcs_data(rcs_mkt_usage), sample_json=options.sample_json)
+    with METRICS.phase('rcs_push', len(rcs_spool.pending())):
+        upload_to_rcs(rcs_spool, context, sample_json=options.sample_json)
     _LOG.info("upload completed")
 
 
+def write_metrics():
+    """
+    writes the run metrics to [main] metrics_file, if one is configured,
+    with the mode of the run added to the name. The spacewalk and splice
+    syncs usually run from separate cron jobs, and would otherwise keep
+    replacing each other's file. A failure here is logged, it should never
+    fail the run.
+    """
+    metrics_file = utils.cfg_get(CONFIG, 'main', 'metrics_file')
+    if not metrics_file:
+        return
+    metrics_file = metrics.mode_path(metrics_file, METRICS.mode)
+    try:
+        METRICS.write(metrics_file)
+    except (IOError, OSError), e:
+        _LOG.error("unable to write metrics to %s: %s" % (metrics_file, e))
+
+
 def main(options):
 
-    global CONFIG
+    global CONFIG, METRICS
     CONFIG = utils.cfg_init(config_file=constants.SPLICE_CHECKIN_CONFIG)
+    if options.spacewalk_sync:
+        mode = 'spacewalk'
+    elif options.splice_sync:
+        mode = 'splice'
+    else:
+        mode = 'full'
+    METRICS = metrics.RunMetrics(mode)
 
-    start_time = time.time()
-    _LOG.info("run starting")
+    _LOG.info("%s run starting" % mode)
 
     socket.setdefaulttimeout(CONFIG.getfloat('main', 'socket_timeout'))
 
-    if options.spacewalk_sync:
-        spacewalk_sync(options)
-    elif options.splice_sync:
-        splice_sync(options)
-    else:
-        spacewalk_sync(options)
-        splice_sync(options)
+    if options.record:
+        cassette.install(options.record, cassette.RECORD)
+    elif options.replay:
+        cassette.install(options.replay, cassette.REPLAY, options.replay_latency)
 
-    finish_time = time.time() - start_time
-    _LOG.info("run complete") 
+    success = False
+    try:
+        if mode == 'spacewalk':
+            spacewalk_sync(options)
+        elif mode == 'splice':
+            splice_sync(options)
+        else:
+            spacewalk_sync(options)
+            splice_sync(options)
+        success = True
+    finally:
+        finish_time = METRICS.finish(success)
+        write_metrics()
+        if success:
+            _LOG.info("run complete in %.1f seconds" % finish_time)
+        else:
+            _LOG.error("run failed after %.1f seconds" % finish_time)
@@ -12,12 +12,32 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 
 import base64
+import gzip
+import httplib
+import os
+import socket
+import StringIO
+import tempfile
 import simplejson as json
 from M2Crypto import SSL, httpslib
 
+from spacewalk_splice_tool import cassette
+
+# bytes read from a file body per send
+BLOCK_SIZE = 64 * 1024
+
+# requests that can be sent again without changing the outcome
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
 class BaseConnection(object):
+    """
+    JSON over HTTPS connection. The SSL context is built once and the
+    connection is kept alive between requests; call close() when done.
+    With gzip_body set, request bodies are sent with Content-Encoding: gzip.
+    """
     def __init__(self, host, port, handler, username=None,
-                 password=None, cert_file=None, key_file=None, ca_cert=None):
+                 password=None, cert_file=None, key_file=None, ca_cert=None,
+                 gzip_body=False):
         self.host = host
         self.port = port
         self.handler = handler
@@ -28,6 +48,9 @@ class BaseConnection(object):
         self.cert_file = cert_file
         self.cert_key = key_file
         self.ca_cert  = ca_cert
+        self.gzip_body = gzip_body
+        self._context = None
+        self._conn = None
 
     def set_basic_auth(self):
         encoded = base64.b64decode(':'.join((self.username, self.password)))
@@ -42,25 +65,128 @@ class BaseConnection(object):
             context.load_cert(self.cert_file, keyfile=self.cert_key)
         return context
 
+    def _get_connection(self):
+        if self._conn is None:
+            if self._context is None:
+                # loading the certs from disk is only done once
+                self._context = self.set_ssl_context()
+            self._conn = httpslib.HTTPSConnection(self.host, self.port, ssl_context=self._context)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _encode_body(self, body):
+        headers = dict(self.headers)
+        data = json.dumps(body)
+        if self.gzip_body:
+            buf = StringIO.StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode='wb')
+            try:
+                gz.write(data)
+            finally:
+                gz.close()
+            data = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        return data, headers
+
     def _request(self, request_type, method, body=None):
+        """
+        returns (status, body), with the body decoded from JSON if possible
+        """
+        data, headers = self._encode_body(body)
+        return self._send(request_type, method, headers, data)
+
+    def _send(self, request_type, method, headers, body):
+        """
+        send a request whose body is a string or a file, which is streamed
+        to the socket a block at a time. If a cassette is installed the
+        exchange is recorded, or answered from the cassette on replay.
+        """
+        tape = cassette.active()
+        if tape is None:
+            return self._send_live(request_type, method, headers, body)
+        return tape.play("%s %s" % (request_type, self.handler + method), "",
+                         lambda: self._send_live(request_type, method, headers, body))
+
+    def _send_live(self, request_type, method, headers, body):
         if self.username and self.password:
             # add the basic auth info to headers
             self.set_basic_auth()
-        # initialize a context for ssl connection
-        context = self.set_ssl_context()
-        # ssl connection
-        conn = httpslib.HTTPSConnection(self.host, self.port, ssl_context=context)
-        conn.request(request_type, self.handler + method, body=json.dumps(body), headers=self.headers)
-        response = conn.getresponse()
-        if response.status not in [200, 202]:
-            raise Exception()
-        data = response.read()
-        if not len(data):
-            return None
-        return json.loads(data)
+            headers['Authorization'] = self.headers['Authorization']
+
+        while True:
+            reused = self._conn is not None
+            sent = False
+            conn = self._get_connection()
+            try:
+                if hasattr(body, 'read'):
+                    body.seek(0)
+                    conn.putrequest(request_type, self.handler + method)
+                    for header, value in headers.items():
+                        conn.putheader(header, value)
+                    conn.putheader('Content-Length', str(os.fstat(body.fileno()).st_size))
+                    conn.endheaders()
+                    block = body.read(BLOCK_SIZE)
+                    while block:
+                        conn.send(block)
+                        block = body.read(BLOCK_SIZE)
+                else:
+                    conn.request(request_type, self.handler + method, body=body, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                response_body = response.read()
+                break
+            except (httplib.HTTPException, socket.error, SSL.SSLError):
+                self.close()
+                # the server may have dropped a kept-alive connection, which
+                # is worth one more try on a fresh one. Once the whole request
+                # is out it may have been acted on, so only a request that is
+                # safe to repeat is sent again, the rest is left to the
+                # caller's own retries.
+                if not reused or (sent and request_type not in IDEMPOTENT_METHODS):
+                    raise
+
+        if response.will_close:
+            self.close()
+        if response_body:
+            try:
+                response_body = json.loads(response_body)
+            except ValueError:
+                pass
+        return response.status, response_body
 
     def GET(self, method):
         return self._request("GET", method)
 
     def POST(self, method, params=""):
         return self._request("POST", method, params)
+
+    def POST_file(self, method, fileobj):
+        """
+        POST a JSON document that is already serialized to a file, without
+        reading it all into memory
+        """
+        headers = dict(self.headers)
+        compressed = None
+        if self.gzip_body:
+            compressed = tempfile.TemporaryFile()
+            gz = gzip.GzipFile(fileobj=compressed, mode='wb')
+            try:
+                fileobj.seek(0)
+                block = fileobj.read(BLOCK_SIZE)
+                while block:
+                    gz.write(block)
+                    block = fileobj.read(BLOCK_SIZE)
+            finally:
+                gz.close()
+            compressed.flush()
+            fileobj = compressed
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            return self._send("POST", method, headers, fileobj)
+        finally:
+            if compressed is not None:
+                compressed.close()
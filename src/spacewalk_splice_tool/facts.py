@@ -24,16 +24,39 @@ def translate_sw_facts_to_subsmgr(system_details):
     facts['systemid'] = system_details['server_id']
     # leave this blank in the katello UI
     facts['distribution.name'] = ""
-    facts.update(cpu_facts(system_details))
-    facts.update(network_facts(system_details))
+    hardware = parse_hardware(system_details.get('hardware'))
+    facts.update(cpu_facts(system_details, hardware))
+    facts.update(network_facts(system_details, hardware))
     facts.update(memory_facts(system_details))
     #facts.update(guest_facts(system_details))
     return facts
 
 
-def cpu_facts(cpuinfo):
+def parse_hardware(hardware):
+    """
+    Parse the hardware column of the splice-export report, e.g.
+    "2 CPUs 1 Sockets; eth0 10.0.0.5/255.255.255.0 12:31:39:16:a2:67; lo ..."
+    in a single pass.
+    @return (cpu count, [(interface, ipv4 address, netmask, mac address), ...]);
+    the cpu count is None if the column is empty or missing
+    """
+    if not hardware:
+        return None, []
+    sections = hardware.split(';')
+    cpu_count = sections[0].split()[0]
+    interfaces = []
+    for section in sections[1:]:
+        (iface, addrmask, hwaddr) = section.split()
+        addrmask = addrmask.split('/')
+        interfaces.append((iface, addrmask[0], addrmask[1], hwaddr))
+    return cpu_count, interfaces
+
+
+def cpu_facts(cpuinfo, hardware=None):
     """
     Translate the cpu facts from spacewalk server to subscription mgr format
+    @param hardware: cpuinfo['hardware'] as returned by parse_hardware, if
+    the caller has already parsed it
     """
     # we set this to 1 by default so candlepin does not remove the field from
     # the facts list. This is needed so the fact can bubble through to RCS.
@@ -41,9 +64,11 @@ def cpu_facts(cpuinfo):
     if cpuinfo.has_key("sockets") and len(cpuinfo['sockets']) > 0:
         cpu_socket_count = cpuinfo['sockets']
 
-    cpu_count = 1
-    if cpuinfo.has_key("hardware") and len(cpuinfo['hardware']) > 0:
-        cpu_count = cpuinfo['hardware'].split(';')[0].split()[0]
+    if hardware is None:
+        hardware = parse_hardware(cpuinfo.get('hardware'))
+    cpu_count = hardware[0]
+    if cpu_count is None:
+        cpu_count = 1
 
     cpu_facts_dict = dict()
 
@@ -88,20 +113,21 @@ def memory_facts(meminfo):
     return mem_facts_dict
 
 
-def network_facts(nwkinfo):
+def network_facts(nwkinfo, hardware=None):
     """
     Translate network interface facts
+    @param hardware: nwkinfo['hardware'] as returned by parse_hardware, if
+    the caller has already parsed it
     """
     nwk_facts_dict = dict()
-    nwk_info_by_interface = {}
 
-    network_info = nwkinfo['hardware'].split(';')[1:]
-    for n in network_info:
-        (iface, addrmask, hwaddr) = n.split()
+    if hardware is None:
+        hardware = parse_hardware(nwkinfo['hardware'])
+    for (iface, address, netmask, hwaddr) in hardware[1]:
         nwk_facts_dict['net.interface.' + iface + '.mac_address'] = hwaddr
-        nwk_facts_dict['net.interface.' + iface + '.ipv4_address'] = addrmask.split('/')[0]
-        nwk_facts_dict['net.interface.' + iface + '.netmask'] = addrmask.split('/')[1]
-        
+        nwk_facts_dict['net.interface.' + iface + '.ipv4_address'] = address
+        nwk_facts_dict['net.interface.' + iface + '.netmask'] = netmask
+
     nwk_facts_dict['net.ipv4_address'] = nwkinfo['ip_address']
     nwk_facts_dict['network.hostname'] = nwkinfo['hostname']
 
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import base64
 import logging
+import multiprocessing
 import sys
 import itertools
 import urllib
@@ -32,7 +33,7 @@ import httplib
 import logging
 import base64
 import json
-from spacewalk_splice_tool import utils, constants
+from spacewalk_splice_tool import cassette, utils, constants, pipeline
 from splice.common.models import Product, Pool, Rules
 from splice.common.utils import convert_to_datetime
 
@@ -44,6 +45,41 @@ logutil.init_logger()
 class NotFoundException():
     pass
 
+class SpacewalkIDIndex(object):
+    """
+    The katello systems of a run, by uuid and, where known, by (org label,
+    spacewalk id). A systems_by_org listing does not carry the spacewalk id,
+    unlike the detailed one, so a system missing from the index may still be
+    in katello: lookup() says whether findBySpacewalkID has to be asked.
+    """
+
+    def __init__(self):
+        self.uuids = set()
+        self._by_spacewalk_id = {}
+        # orgs with systems the listing gave no spacewalk id for
+        self._unresolved = set()
+
+    def add(self, org_id, uuid, spacewalk_id=None):
+        self.uuids.add(uuid)
+        if spacewalk_id is None:
+            self._unresolved.add(org_id)
+            return
+        if (org_id, spacewalk_id) in self._by_spacewalk_id:
+            raise Exception("more than one record found for spacewalk ID %s in org %s!" % (spacewalk_id, org_id))
+        self._by_spacewalk_id[(org_id, spacewalk_id)] = uuid
+
+    def lookup(self, org_id, spacewalk_id):
+        """
+        returns (uuid, resolved). uuid is the katello uuid if the index has
+        it. If resolved is False the index can't tell either way, and the
+        system has to be looked up.
+        """
+        uuid = self._by_spacewalk_id.get((org_id, spacewalk_id))
+        if uuid is not None:
+            return uuid, True
+        return None, org_id not in self._unresolved
+
+
 class KatelloConnection():
 
     def __init__(self):
@@ -56,13 +92,16 @@ class KatelloConnection():
         self.distributorapi  = DistributorAPI()
         self.provapi  = ProviderAPI()
         self.infoapi  = CustomInfoAPI()
+        # role name -> role, role ids don't change during a run
+        self._roles_by_name = {}
         s = server.KatelloServer(CONFIG.get("katello", "hostname"),
                                  CONFIG.get("katello", "port"),
                                  CONFIG.get("katello", "proto"),
                                  CONFIG.get("katello", "api_url"))
         s.set_auth_method(BasicAuthentication(CONFIG.get("katello", "admin_user"), CONFIG.get("katello", "admin_pass")))
         server.set_active_server(s)
-
+        # record or replay the API calls if a cassette is installed
+        cassette.wrap_katello(self)
 
     def getOwners(self):
         return self.orgapi.organizations()
@@ -107,6 +146,36 @@ class KatelloConnection():
             raise Exception("more than one record found for spacewalk ID %s in org %s!" % (spacewalk_id, org))
 
         return result
+
+    def getSpacewalkIDIndex(self, consumer_list=None):
+        """
+        returns a SpacewalkIDIndex of every system in katello. If
+        consumer_list, the detailed listing from getConsumers(), is given
+        the index is built from its systemid facts without asking katello
+        again, else from one systems_by_org pass per org.
+        """
+        index = SpacewalkIDIndex()
+        if consumer_list is not None:
+            for consumer in consumer_list:
+                index.add(consumer['owner']['key'], consumer['uuid'],
+                          self._getSpacewalkID(consumer))
+            return index
+        # the API wants "orgId" but they mean "label"
+        org_ids = map(lambda x: x['label'], self.orgapi.organizations())
+        for org_id in org_ids:
+            for system in self.systemapi.systems_by_org(orgId=org_id):
+                index.add(org_id, system['uuid'], self._getSpacewalkID(system))
+        return index
+
+    def _getSpacewalkID(self, system):
+        # createConsumer stores the id as custom info, and the systemid fact
+        # carries the same value. A plain systems_by_org listing has
+        # neither, so this is None for most systems unless they come from
+        # getConsumers().
+        for info in system.get('custom_info') or []:
+            if info.get('keyname') == 'spacewalk-id':
+                return info.get('value')
+        return (system.get('facts') or {}).get('systemid')
         
     def createConsumer(self, name, facts, installed_products, last_checkin,
                         sw_uuid=None, owner=None, spacewalk_server_hostname = None):
@@ -145,29 +214,68 @@ class KatelloConnection():
         self.systemapi.checkin(cp_uuid, self._convert_date(last_checkin))
         self.systemapi.refresh_subscriptions(cp_uuid)
 
-    def getConsumers(self, owner=None, with_details=True):
-        # TODO: this has a lot of logic and could be refactored
-        
+    def getConsumers(self, owner=None, with_details=True, workers=None):
+        consumer_list = self._listConsumers()
+        # return what we have, if we don't need the detailed list
+        if not with_details:
+            return consumer_list
+
+        # unfortunately, we need to call again to get the "full" consumer with
+        # facts
+        return list(self._iterDetails(_fetch_consumer, consumer_list, workers))
+
+    def harvestConsumers(self, consumer_list=None, workers=None):
+        """
+        yields the full consumer, with 'entitlement_status' and
+        'entitlements' filled in, for every system in consumer_list (from
+        getConsumers(with_details=False)) or else every system in katello.
+        Everything about a system is fetched in one job, so a splice sync
+        needs a single pass over the consumers.
+        """
+        if consumer_list is None:
+            consumer_list = self._listConsumers()
+        return self._iterDetails(_harvest_consumer, consumer_list, workers)
+
+    def _listConsumers(self):
         # the API wants "orgId" but they mean "label"
         org_ids = map(lambda x: x['label'], self.orgapi.organizations())
         consumer_list = []
         for org_id in org_ids:
             consumer_list.append(self.systemapi.systems_by_org(orgId=org_id))
-        
-        # flatten the list
-        consumer_list = list(itertools.chain.from_iterable(consumer_list))
-        # return what we have, if we don't need the detailed list
-        if not with_details:
-            return consumer_list
-
-        full_consumers_list = []
-        # unfortunately, we need to call again to get the "full" consumer with facts
-        for consumer in consumer_list:
-            full_consumer = self._getConsumer(consumer['uuid'])
-            full_consumer['entitlement_status'] = self.getSubscriptionStatus(consumer['uuid'])
-            full_consumers_list.append(full_consumer)
 
-        return full_consumers_list
+        # flatten the list
+        return list(itertools.chain.from_iterable(consumer_list))
+
+    def _iterDetails(self, func, consumer_list, workers=None):
+        """
+        yields func(connection, uuid) for each consumer, in order, spread
+        over [katello] fetch_workers processes. Consumers deleted from
+        katello since they were listed are skipped. Any other failure stops
+        the iteration right away, so the callers don't go on to spool or
+        delete on the strength of a partial listing.
+        """
+        if workers is None:
+            workers = utils.cfg_getint(CONFIG, "katello", "fetch_workers", 1)
+        total = len(consumer_list)
+        done = 0
+        gone = 0
+        for args, ok, result in run_jobs(func,
+                                         [(c['uuid'],) for c in consumer_list],
+                                         workers, self):
+            if not ok:
+                # the failure has already been logged by run_jobs
+                raise Exception("unable to fetch details for consumer %s from katello: %s" %
+                                (args[0], result))
+            done += 1
+            if result is None:
+                gone += 1
+            else:
+                yield result
+            if (done % 100) == 0 or done == total:
+                _LOG.info("fetched details for %s of %s consumers" % (done, total))
+
+        if gone:
+            _LOG.info("skipped %s consumers that were deleted during the run" % gone)
     
 
     def _getConsumer(self, consumer_uuid):
@@ -190,26 +298,100 @@ class KatelloConnection():
                                          description="generated from spacewalk", type_in="organizations", verbs=None,
                                          tagIds=None, orgId=kt_org_label, all_tags=True, all_verbs=True)
 
+    def _getRoleByName(self, name):
+        if name not in self._roles_by_name:
+            self._roles_by_name[name] = self.rolesapi.role_by_name(name=name)
+        return self._roles_by_name[name]
+
     def grantOrgAdmin(self, kt_user, kt_org_label):
-        oa_role = self.rolesapi.role_by_name(name="Org Admin Role for %s" % kt_org_label)
+        oa_role = self._getRoleByName("Org Admin Role for %s" % kt_org_label)
         self.userapi.assign_role(user_id=kt_user['id'], role_id=oa_role['id'])
 
     def ungrantOrgAdmin(self, kt_user, kt_org_label):
-        oa_role = self.rolesapi.role_by_name(name="Org Admin Role for %s" % kt_org_label)
+        oa_role = self._getRoleByName("Org Admin Role for %s" % kt_org_label)
         self.userapi.unassign_role(user_id=kt_user['id'], role_id=oa_role['id'])
 
     def grantFullAdmin(self, kt_user):
-        admin_role = self.rolesapi.role_by_name(name="Administrator")
+        admin_role = self._getRoleByName("Administrator")
         self.userapi.assign_role(user_id=kt_user['id'], role_id=admin_role['id'])
 
-    def ungrantFullAdmin(self, kt_user, kt_org_label):
-        admin_role = self.rolesapi.role_by_name(name="Administrator")
+    def ungrantFullAdmin(self, kt_user, kt_org_label=None):
+        admin_role = self._getRoleByName("Administrator")
         self.userapi.unassign_role(user_id=kt_user['id'], role_id=admin_role['id'])
 
     def _convert_date(self, dt):
         retval = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
         return retval
 
+# the KatelloConnection of a run_jobs worker process
+_WORKER_CONNECTION = None
+# jobs run_jobs keeps queued per worker
+JOB_BACKLOG = 4
+
+def _init_worker():
+    global _WORKER_CONNECTION
+    _WORKER_CONNECTION = KatelloConnection()
+
+def _call(func, connection, args):
+    try:
+        return args, True, func(connection, *args)
+    except Exception, e:
+        _LOG.exception("katello job %s%s failed" % (func.__name__, args))
+        return args, False, str(e)
+
+def _consumer_details(connection, consumer_uuid, with_entitlements):
+    # a consumer deleted since it was listed is None, not an error
+    try:
+        full_consumer = connection._getConsumer(consumer_uuid)
+        full_consumer['entitlement_status'] = connection.getSubscriptionStatus(consumer_uuid)
+        if with_entitlements:
+            full_consumer['entitlements'] = connection.getEntitlements(consumer_uuid)
+    except server.ServerRequestError, e:
+        if e[0] != 404:
+            raise
+        _LOG.warning("consumer %s is no longer in katello, skipping it" % consumer_uuid)
+        return None
+    return full_consumer
+
+def _fetch_consumer(connection, consumer_uuid):
+    return _consumer_details(connection, consumer_uuid, False)
+
+def _harvest_consumer(connection, consumer_uuid):
+    return _consumer_details(connection, consumer_uuid, True)
+
+def _run_job(job):
+    func, args = job
+    return _call(func, _WORKER_CONNECTION, args)
+
+def run_jobs(func, arg_list, workers=1, connection=None):
+    """
+    Calls func(connection, *args) for each args tuple in arg_list and yields
+    (args, ok, result) in input order. If the call raised, ok is False and
+    result is the error message, so one bad record does not stop the rest.
+
+    With more than one worker the calls are spread over a pool of processes
+    that each open their own KatelloConnection, since the katello client
+    keeps its active server in process wide state. func must then be a
+    module level function so it can be handed to the workers. Only a few
+    jobs per worker are read ahead of the results, so arg_list can be a
+    generator over a stream.
+    """
+    if workers <= 1:
+        if connection is None:
+            connection = KatelloConnection()
+        for args in arg_list:
+            yield _call(func, connection, args)
+        return
+
+    results = pipeline.pool_map(multiprocessing.Pool(workers, _init_worker), _run_job,
+                                (((func, args),) for args in arg_list),
+                                workers * JOB_BACKLOG)
+    try:
+        for job, result in results:
+            yield result
+    finally:
+        results.close()
+
 if __name__ == '__main__':
     kc = KatelloConnection()
     print kc.getOwners()
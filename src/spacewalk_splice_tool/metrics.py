@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import time
+
+_LOG = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'spacewalk_splice_tool'
+
+
+def mode_path(path, mode):
+    """
+    path with mode added before its extension, e.g. checkin-splice.prom for
+    checkin.prom, so runs of each mode keep a metrics file of their own
+    """
+    if not mode:
+        return path
+    root, ext = os.path.splitext(path)
+    return "%s-%s%s" % (root, mode, ext)
+
+
+class Phase(object):
+    """
+    wall time and item count for one phase of a run. Set items inside the
+    RunMetrics.phase() block once the number of things handled is known.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.items = None
+        self.failed = False
+
+    def items_per_second(self):
+        if self.items is None or not self.seconds:
+            return None
+        return self.items / self.seconds
+
+    def to_dict(self):
+        return {'name': self.name,
+                'seconds': round(self.seconds, 3),
+                'items': self.items,
+                'items_per_second': self.items_per_second(),
+                'failed': self.failed}
+
+
+class RunMetrics(object):
+    """
+    Collects per phase timings for one checkin run and writes them out as
+    JSON, or as a node-exporter textfile if the file name ends in .prom.
+    Running a phase name again adds to its time and item count. mode names
+    the kind of run (spacewalk, splice or full) and labels every sample, so
+    runs of different modes can be told apart once collected.
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode
+        self.start_time = time.time()
+        self.finish_time = None
+        self.success = None
+        self._phases = []
+        self._by_name = {}
+
+    def _get_phase(self, name):
+        if name not in self._by_name:
+            self._by_name[name] = Phase(name)
+            self._phases.append(self._by_name[name])
+        return self._by_name[name]
+
+    @contextmanager
+    def phase(self, name, items=None):
+        phase = Phase(name)
+        phase.items = items
+        start = time.time()
+        try:
+            try:
+                yield phase
+            except:
+                phase.failed = True
+                raise
+        finally:
+            phase.seconds = time.time() - start
+            self.add(phase.name, phase.seconds, phase.items, phase.failed)
+            _LOG.debug("phase %s took %.2f seconds" % (name, phase.seconds))
+
+    def add(self, name, seconds, items=None, failed=False):
+        """
+        records time spent outside a phase() block, e.g. by a worker thread
+        """
+        phase = self._get_phase(name)
+        phase.seconds += seconds
+        if items is not None:
+            phase.items = (phase.items or 0) + items
+        phase.failed = phase.failed or failed
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def finish(self, success):
+        self.finish_time = time.time()
+        self.success = success
+        return self.finish_time - self.start_time
+
+    def to_dict(self):
+        finish_time = self.finish_time or time.time()
+        return {'mode': self.mode,
+                'start_time': self.start_time,
+                'finish_time': finish_time,
+                'seconds': round(finish_time - self.start_time, 3),
+                'success': self.success,
+                'phases': [phase.to_dict() for phase in self._phases]}
+
+    def to_textfile(self):
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, help_text, samples):
+            name = "%s_%s" % (METRIC_PREFIX, name)
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s gauge" % name)
+            for phase, value in samples:
+                labels = []
+                if self.mode:
+                    labels.append('mode="%s"' % self.mode)
+                if phase:
+                    labels.append('phase="%s"' % phase)
+                if labels:
+                    lines.append('%s{%s} %s' % (name, ",".join(labels), repr(float(value))))
+                else:
+                    lines.append('%s %s' % (name, repr(float(value))))
+
+        metric('run_seconds', 'Wall time of the last checkin run.',
+               [(None, data['seconds'])])
+        metric('run_finish_time_seconds', 'Unix time the last checkin run finished.',
+               [(None, data['finish_time'])])
+        metric('run_success', '1 if the last checkin run finished without errors.',
+               [(None, data['success'] and 1 or 0)])
+        metric('phase_seconds', 'Wall time of each phase of the last run.',
+               [(p.name, p.seconds) for p in self._phases])
+        metric('phase_items', 'Items handled by each phase of the last run.',
+               [(p.name, p.items) for p in self._phases if p.items is not None])
+        metric('phase_items_per_second', 'Throughput of each phase of the last run.',
+               [(p.name, p.items_per_second()) for p in self._phases
+                if p.items_per_second() is not None])
+        metric('phase_failed', '1 if the phase raised an error.',
+               [(p.name, p.failed and 1 or 0) for p in self._phases])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        writes the metrics to path, replacing it atomically so a collector
+        never reads a half written file
+        """
+        if path.endswith('.prom'):
+            content = self.to_textfile()
+        else:
+            content = json.dumps(self.to_dict(), indent=4)
+        metrics_dir = os.path.dirname(path)
+        if metrics_dir and not os.path.exists(metrics_dir):
+            os.makedirs(metrics_dir)
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'w')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+"""
+Building blocks for running the spacewalk sync as a stream. Each stage is
+a generator over the one before it, so a system row is parsed, translated
+and handed to the katello upload before the next one is read, and only a
+bounded number of rows are in flight at any time.
+"""
+
+import collections
+from itertools import islice, izip
+import multiprocessing
+import Queue
+import sys
+import threading
+import time
+
+# how long a blocked producer waits before checking if it should stop
+_PUT_TIMEOUT = 0.5
+
+# chunks process_map keeps queued per worker
+CHUNK_BACKLOG = 2
+
+_END = object()
+_ERROR = object()
+
+
+def buffered(items, maxsize=1000):
+    """
+    Iterates items in a thread of its own and yields them from a queue of
+    at most maxsize, so the source (e.g. the ssh pipe of a report) keeps
+    being read while the stages after it wait on katello. The producer
+    blocks when the queue is full. An error raised by the source is raised
+    again here, and closing this generator stops the producer.
+    """
+    queue = Queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.isSet():
+            try:
+                queue.put(entry, True, _PUT_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            try:
+                for item in items:
+                    if not put((None, item)):
+                        return
+                put((_END, None))
+            finally:
+                # lets a generator source clean up, e.g. reap its ssh process
+                if hasattr(items, 'close'):
+                    items.close()
+        except:
+            put((_ERROR, sys.exc_info()))
+
+    producer = threading.Thread(target=produce, name='pipeline-buffer')
+    producer.setDaemon(True)
+    producer.start()
+    try:
+        while True:
+            marker, value = queue.get()
+            if marker is _END:
+                break
+            if marker is _ERROR:
+                raise value[0], value[1], value[2]
+            yield value
+    finally:
+        stop.set()
+        producer.join()
+
+
+def stage(func, items, name=None, metrics=None):
+    """
+    Lazily yields func(item) for each item. If metrics (a RunMetrics) is
+    given, the time spent in func and the number of items are added to its
+    name phase once the stream ends, which only counts this stage and not
+    the time spent waiting on the ones around it. Closing this generator
+    closes items too.
+    """
+    seconds = 0.0
+    count = 0
+    try:
+        for item in items:
+            start = time.time()
+            result = func(item)
+            seconds += time.time() - start
+            count += 1
+            yield result
+    finally:
+        # pass an early close on to the stages before this one
+        if hasattr(items, 'close'):
+            items.close()
+        if metrics is not None:
+            metrics.add(name, seconds, count)
+
+
+def pool_map(pool, func, arg_list, backlog):
+    """
+    Yields (args, func(*args)) for each args tuple in arg_list, in order,
+    with the calls run on pool, a multiprocessing.Pool. pool.imap would read
+    all of arg_list up front, so calls are submitted as results are taken
+    instead, at most backlog ahead, and arg_list can be a generator over a
+    stream. The pool is closed once the results run out, and terminated if
+    they are not all taken.
+    """
+    pending = collections.deque()
+    finished = False
+    try:
+        for args in arg_list:
+            pending.append((args, pool.apply_async(func, args)))
+            if len(pending) >= backlog:
+                args, result = pending.popleft()
+                yield args, result.get()
+        while pending:
+            args, result = pending.popleft()
+            yield args, result.get()
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+def _chunks(items, chunk_size):
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _map_chunk(func, chunk):
+    # timed in the worker, so waiting on the pool or on the stages before
+    # process_map is not counted
+    start = time.time()
+    mapped = [func(item) for item in chunk]
+    return time.time() - start, mapped
+
+
+def process_map(func, items, workers, chunk_size=500, name=None, metrics=None):
+    """
+    Yields (item, func(item)) for each item, in order, with func run in a
+    pool of worker processes on chunks of chunk_size items. This is for CPU
+    bound stages, where threads would just take turns on the GIL. func must
+    be a module level function, and items and results must pickle. Only a
+    few chunks per worker are read ahead of the results. If metrics (a
+    RunMetrics) is given, the time spent in func, summed over the workers,
+    and the number of items are added to its name phase once the stream
+    ends. Closing this generator closes items too.
+    """
+    results = pool_map(multiprocessing.Pool(workers), _map_chunk,
+                       ((func, chunk) for chunk in _chunks(items, chunk_size)),
+                       workers * CHUNK_BACKLOG)
+    seconds = 0.0
+    count = 0
+    try:
+        for (_, chunk), (elapsed, mapped) in results:
+            seconds += elapsed
+            count += len(mapped)
+            for pair in izip(chunk, mapped):
+                yield pair
+    finally:
+        results.close()
+        if hasattr(items, 'close'):
+            items.close()
+        if metrics is not None:
+            metrics.add(name, seconds, count)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+"""
+Compact records for the per system data of a sync. There is one of each
+per system, so with 100k systems the overhead of a dict per record adds up.
+
+SystemRow and Consumer keep their fields in __slots__. Facts keep their
+values in a tuple, and the key tuple is shared by every system with the
+same set of facts. All of them can be read like the dicts they replace, so
+code that handles a record does not care which one it has.
+"""
+
+from itertools import izip
+
+
+class Record(object):
+    """
+    Dict-like record with its known fields in __slots__. Keys that are not
+    fields are kept in a small dict that is only created when one is set.
+    """
+    FIELDS = ()
+    __slots__ = ('_extra',)
+    _field_set = frozenset()
+
+    def __init__(self, data=None, **kwargs):
+        if data is not None:
+            self.update(data)
+        if kwargs:
+            self.update(kwargs)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, value)
+            return
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            extra = self._extra = {}
+        extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+            return
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            raise KeyError(key)
+        del extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [f for f in self.FIELDS if hasattr(self, f)]
+        extra = getattr(self, '_extra', None)
+        if extra:
+            keys.extend(extra.keys())
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def update(self, data):
+        if hasattr(data, 'keys'):
+            for key in data.keys():
+                self[key] = data[key]
+        else:
+            for key, value in data:
+                self[key] = value
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_dict())
+
+    # pickle support, for handing records to worker processes
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.update(state)
+
+
+# splice-export columns, see scripts/splice-export
+SYSTEM_FIELDS = ('server_id', 'organization', 'org_id', 'name', 'hostname',
+                 'ip_address', 'ipv6_address', 'registered_by',
+                 'registration_time', 'last_checkin_time', 'software_channel',
+                 'entitlements', 'system_group', 'virtual_host',
+                 'architecture', 'hardware', 'memory', 'sockets')
+
+# columns that hold one of a few values across a whole satellite, so every
+# row can share the same string
+SYSTEM_INTERNED = frozenset(['organization', 'org_id', 'ipv6_address',
+                             'registered_by', 'software_channel',
+                             'entitlements', 'system_group', 'virtual_host',
+                             'architecture', 'memory', 'sockets'])
+
+
+class SystemRow(Record):
+    """
+    one row of the splice-export report, plus the installed products that
+    are added to it during the sync
+    """
+    FIELDS = SYSTEM_FIELDS + ('installed_products',)
+    __slots__ = FIELDS
+    _field_set = frozenset(FIELDS)
+
+    @classmethod
+    def from_csv(cls, header, values):
+        row = cls()
+        for key, value in izip(header, values):
+            if key in SYSTEM_INTERNED and type(value) is str:
+                value = intern(value)
+            row[key] = value
+        return row
+
+
+class Consumer(Record):
+    """
+    a spacewalk system translated for upload to katello, as built by
+    checkin.transform_to_consumer
+    """
+    FIELDS = ('id', 'owner', 'name', 'last_checkin', 'facts',
+              'installed_products')
+    __slots__ = FIELDS
+    _field_set = frozenset(FIELDS)
+
+
+# key tuple -> the shared copy of it
+_FACT_LAYOUTS = {}
+
+
+class Facts(object):
+    """
+    Read-only, tuple backed facts. Systems with the same fact names share
+    one key tuple, so each system only holds a tuple of values, and short
+    string values are interned so repeated ones are a single object.
+    Use dict(facts) where a real dict is needed, e.g. to send it to katello.
+    """
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, data):
+        keys = tuple(sorted(data.keys()))
+        layout = _FACT_LAYOUTS.get(keys)
+        if layout is None:
+            layout = _FACT_LAYOUTS[keys] = tuple([intern(k) if type(k) is str else k
+                                                  for k in keys])
+        self._keys = layout
+        values = []
+        for key in layout:
+            value = data[key]
+            # short values (architectures, counts, placeholders) repeat from
+            # system to system; addresses and names mostly don't
+            if type(value) is str and len(value) <= 8:
+                value = intern(value)
+            values.append(value)
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        # the key tuple is sorted, but with ~30 keys a scan is as quick
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def iteritems(self):
+        return izip(self._keys, self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, (Facts, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return "Facts(%r)" % dict(self.items())
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self.__init__(state)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import itertools
+import json
+import logging
+import os
+import time
+
+_LOG = logging.getLogger(__name__)
+
+
+class JsonObjectsWriter(object):
+    """
+    Writes {"objects": [...]} to a file one record at a time, so only the
+    record being written is held in memory. Without indent every record
+    takes exactly one line, which iter_json_objects relies on.
+    """
+
+    def __init__(self, fileobj, indent=None):
+        self.fileobj = fileobj
+        self.indent = indent
+        self.count = 0
+        self.fileobj.write('{"objects": [\n')
+
+    def write(self, record):
+        if self.count:
+            self.fileobj.write(',\n')
+        self.fileobj.write(json.dumps(record, indent=self.indent))
+        self.count += 1
+
+    def close(self):
+        self.fileobj.write('\n]}\n')
+
+
+def iter_json_objects(fileobj):
+    """
+    yields the records of a file written by a JsonObjectsWriter without
+    indent, one line at a time
+    """
+    for line in fileobj:
+        line = line.rstrip('\n')
+        if line in ('{"objects": [', ']}', ''):
+            continue
+        if line.endswith(','):
+            line = line[:-1]
+        yield json.loads(line)
+
+
+class ChunkSpool(object):
+    """
+    A directory of numbered JSON chunk files waiting to be uploaded. Each
+    chunk holds {"objects": [...]} with at most chunk_size records. A chunk
+    is removed once the server has accepted it, so whatever is left after a
+    failed run is picked up by the next one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def add(self, records, chunk_size):
+        """
+        write records, which may be any iterable, out as chunks of
+        chunk_size (all in one chunk if chunk_size is 0) and return the
+        number of chunks written. Records are written as they are produced.
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        # chunk names sort by run, then by position in the run
+        run_id = "%.6f" % time.time()
+        records = iter(records)
+        written = 0
+        for first in records:
+            chunk_path = os.path.join(self.path, "mpu-%s-%06d.json" % (run_id, written))
+            tmp_path = chunk_path + '.tmp'
+            f = open(tmp_path, 'w')
+            try:
+                try:
+                    writer = JsonObjectsWriter(f)
+                    writer.write(first)
+                    if chunk_size > 0:
+                        rest = itertools.islice(records, chunk_size - 1)
+                    else:
+                        rest = records
+                    for record in rest:
+                        writer.write(record)
+                    writer.close()
+                finally:
+                    f.close()
+                os.rename(tmp_path, chunk_path)
+            except:
+                # records can raise part way through a chunk; don't leave
+                # the half written chunk behind
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            written += 1
+        _LOG.info("spooled %s chunks for upload" % written)
+        return written
+
+    def pending(self):
+        """
+        paths of the chunks still waiting to be accepted, oldest first
+        """
+        if not os.path.exists(self.path):
+            return []
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.startswith('mpu-') and name.endswith('.json'))
+
+    def read(self, chunk_path):
+        f = open(chunk_path)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def records(self, chunk_path=None):
+        """
+        yields the records of one chunk, or of every pending chunk, one at a
+        time
+        """
+        if chunk_path is None:
+            chunk_paths = self.pending()
+        else:
+            chunk_paths = [chunk_path]
+        for path in chunk_paths:
+            f = open(path)
+            try:
+                for record in iter_json_objects(f):
+                    yield record
+            finally:
+                f.close()
+
+    def accept(self, chunk_path):
+        os.remove(chunk_path)
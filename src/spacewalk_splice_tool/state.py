@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import json
+import logging
+import os
+
+_LOG = logging.getLogger(__name__)
+
+
+class StateStore(object):
+    """
+    A small JSON backed key/value store for data kept between runs. Nothing
+    is written until save() is called, and save() replaces the file
+    atomically so an interrupted run never leaves a half written store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        f = open(self.path)
+        try:
+            try:
+                self.data = json.load(f)
+            except ValueError, e:
+                _LOG.warning("ignoring unreadable state file %s: %s" % (self.path, e))
+                self.data = {}
+        finally:
+            f.close()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def keys(self):
+        return self.data.keys()
+
+    def save(self):
+        state_dir = os.path.dirname(self.path)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_path = self.path + '.tmp'
+        f = open(tmp_path, 'w')
+        try:
+            json.dump(self.data, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
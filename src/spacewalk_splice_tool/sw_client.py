@@ -14,15 +14,37 @@
 
 from datetime import datetime
 from dateutil.tz import tzutc
+import logging
+import os
 import pprint
+import shutil
 import subprocess
 import sys
 import StringIO
 import csv
+import tempfile
+import threading
+import time
 import traceback
 from optparse import OptionParser
 
-from spacewalk_splice_tool import facts
+from spacewalk_splice_tool import facts, records
+
+_LOG = logging.getLogger(__name__)
+
+# seconds to wait for the ssh control master to come up
+CONTROL_MASTER_TIMEOUT = 30
+
+# reports with a row per system are read into compact records rather than
+# dicts; the small ones stay dicts
+REPORT_ROW_TYPES = {'splice-export': records.SystemRow}
+
+
+class ReportError(Exception):
+    """
+    a spacewalk report did not run to completion
+    """
+    pass
 
 
 class SpacewalkClient(object):
@@ -30,44 +52,163 @@ class SpacewalkClient(object):
     def __init__(self, host, ssh_key_path):
         self.host = host
         self.ssh_key_path = ssh_key_path
+        self._control_dir = None
+        self._control_path = None
+        self._master = None
+        # report name -> rows, so each report runs at most once per client
+        self._reports = {}
+        self._report_locks = {}
+        self._lock = threading.Lock()
 
-    def get_db_output(self, report_path):
-        # capture data from spacewalk
-        process = subprocess.Popen(
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def connect(self):
+        """
+        open a control master ssh session that every report run afterwards is
+        multiplexed over, so the TCP and key exchange cost is paid once per
+        run. If the master can not be started, reports fall back to opening
+        their own ssh connection.
+        """
+        if self._master is not None:
+            return
+        self._control_dir = tempfile.mkdtemp(prefix='sst-ssh-')
+        self._control_path = os.path.join(self._control_dir, 'control')
+        _LOG.info("opening ssh control master to %s" % self.host)
+        self._master = subprocess.Popen(
                     ['/usr/bin/ssh', '-i', self.ssh_key_path,
-                     self.host, '/usr/bin/spacewalk-report', report_path], 
-                    stdout=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+                     '-M', '-N', '-S', self._control_path, self.host])
 
-        reader = csv.DictReader(stdout.decode('ascii').splitlines())
+        deadline = time.time() + CONTROL_MASTER_TIMEOUT
+        while not os.path.exists(self._control_path):
+            if self._master.poll() is not None or time.time() > deadline:
+                _LOG.warning("unable to open ssh control master to %s, "
+                             "falling back to one connection per report" % self.host)
+                self.close()
+                return
+            time.sleep(0.1)
 
-        #XXX: suboptimal 
-        retval = []
-        for r in reader:
-            retval.append(r)
+    def close(self):
+        """
+        shut down the control master session, if there is one
+        """
+        if self._master is not None:
+            if self._master.poll() is None:
+                devnull = open(os.devnull, 'w')
+                try:
+                    subprocess.call(['/usr/bin/ssh', '-S', self._control_path,
+                                     '-O', 'exit', self.host],
+                                    stdout=devnull, stderr=devnull)
+                finally:
+                    devnull.close()
+            if self._master.poll() is None:
+                self._master.terminate()
+            self._master.wait()
+            self._master = None
+        if self._control_dir is not None:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+            self._control_path = None
 
-        return retval
+    def _ssh_command(self, report_path):
+        command = ['/usr/bin/ssh', '-i', self.ssh_key_path]
+        if self._master is not None:
+            command.extend(['-S', self._control_path, '-o', 'ControlMaster=no'])
+        command.extend([self.host, '/usr/bin/spacewalk-report', report_path])
+        return command
+
+    def iter_db_output(self, report_path):
+        """
+        run a spacewalk report and yield its rows as they arrive. The ssh pipe
+        is read a line at a time, so memory stays flat regardless of the size
+        of the report and callers can start work before the report finishes.
+        Rows are dicts, or compact records for the reports in
+        REPORT_ROW_TYPES.
+
+        If the report exits with an error, e.g. because the ssh connection
+        dropped, ReportError is raised once the rows it did send are read,
+        so a truncated report is never taken for the whole of it.
+        """
+        process = subprocess.Popen(self._ssh_command(report_path),
+                                   stdout=subprocess.PIPE)
+        finished = False
+        try:
+            # iter(readline) avoids the read-ahead buffering of file iteration
+            lines = iter(process.stdout.readline, '')
+            row_type = REPORT_ROW_TYPES.get(report_path)
+            if row_type is None:
+                for row in csv.DictReader(lines):
+                    yield row
+            else:
+                reader = csv.reader(lines)
+                # no header means no output at all, which the exit status
+                # check below has to see rather than a StopIteration here
+                header = next(reader, None)
+                if header is not None:
+                    for values in reader:
+                        yield row_type.from_csv(header, values)
+            finished = True
+        finally:
+            process.stdout.close()
+            process.wait()
+        # a stream closed early kills ssh, which is not an error
+        if finished and process.returncode != 0:
+            raise ReportError("spacewalk report %s exited with status %s" %
+                              (report_path, process.returncode))
+
+    def get_db_output(self, report_path):
+        return list(self.iter_db_output(report_path))
+
+    def get_report(self, report_path):
+        """
+        return the rows of a report, running it only the first time it is
+        asked for. Safe to call from several threads; concurrent callers for
+        the same report wait for the one run.
+        """
+        self._lock.acquire()
+        try:
+            report_lock = self._report_locks.setdefault(report_path,
+                                                        threading.Lock())
+        finally:
+            self._lock.release()
+
+        report_lock.acquire()
+        try:
+            if report_path not in self._reports:
+                self._reports[report_path] = self.get_db_output(report_path)
+            return self._reports[report_path]
+        finally:
+            report_lock.release()
+
+    def clear_cache(self):
+        self._reports = {}
 
     def get_system_list(self):
-        return self.get_db_output('splice-export')
+        return self.get_report('splice-export')
+
+    def iter_system_list(self):
+        return self.iter_db_output('splice-export')
 
     def get_host_guest_list(self):
-        return self.get_db_output('hostguests')
+        return self.get_report('hostguests')
 
     def get_channel_list(self):
-        return self.get_db_output('cloned-channels')
+        return self.get_report('cloned-channels')
 
     def get_org_list(self):
         # we grab the full user list and then extract the orgs. This is not as
         # efficient as just getting the orgs from the db, but we may want to
-        # create person consumers in the future.
-        full_user_list = self.get_db_output('users')
+        # create person consumers in the future. The users report is shared
+        # with get_user_list, so it only runs once.
         orgs = {}
-        for u in full_user_list:
+        for u in self.get_user_list():
             orgs[u['organization_id']] = u['organization']
 
         return orgs
 
     def get_user_list(self):
-        users = self.get_db_output('users')
-        return users
+        return self.get_report('users')
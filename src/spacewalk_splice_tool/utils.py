@@ -24,6 +24,7 @@ def system_exit(errcode, message=None):
 def read_mapping_file(mappingfile):
     f = open(mappingfile)
     lines = f.readlines()
+    f.close()
     dic_data = {}
     for line in lines:
         if re.match("^[a-zA-Z]", line):
@@ -40,6 +41,25 @@ def cfg_init(config_file=None, reinit=False):
     CONFIG.read(config_file)
     return CONFIG
 
+def cfg_get(config, section, option, default=None):
+    """
+    like config.get, but falls back to a default for options that older
+    checkin.conf files do not have
+    """
+    if config.has_option(section, option):
+        return config.get(section, option)
+    return default
+
+def cfg_getint(config, section, option, default=0):
+    if config.has_option(section, option):
+        return config.getint(section, option)
+    return default
+
+def cfg_getboolean(config, section, option, default=False):
+    if config.has_option(section, option):
+        return config.getboolean(section, option)
+    return default
+
 def get_release():
     f = open('/etc/redhat-release')
     lines = f.readlines()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+from spacewalk_splice_tool import cassette
+
+
+class FakeConnection(object):
+
+    def __init__(self, orgapi, systemapi):
+        self.orgapi = orgapi
+        self.systemapi = systemapi
+
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cassette.json')
+
+    def tearDown(self):
+        cassette.uninstall()
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self):
+        orgapi = Mock()
+        orgapi.organizations.side_effect = [[{'label': 'satellite-1'}],
+                                            [{'label': 'satellite-1'}, {'label': 'satellite-2'}]]
+        systemapi = Mock()
+        systemapi.system.side_effect = lambda system_id: {'uuid': system_id}
+        systemapi.checkin.side_effect = Exception("katello said no")
+        orgapi.export = Mock(return_value='PK\x03\x04\xff')
+
+        cassette.install(self.path, cassette.RECORD)
+        connection = FakeConnection(orgapi, systemapi)
+        cassette.wrap_katello(connection)
+        connection.orgapi.organizations()
+        connection.orgapi.organizations()
+        connection.systemapi.system(system_id='abc')
+        connection.orgapi.export()
+        self.assertRaises(Exception, connection.systemapi.checkin, 'abc', datetime(2013, 5, 1))
+
+    def replay_connection(self, latency=False):
+        cassette.install(self.path, cassette.REPLAY, latency)
+        connection = FakeConnection(Mock(), Mock())
+        cassette.wrap_katello(connection)
+        return connection
+
+    def test_replay(self):
+        self.record()
+        connection = self.replay_connection()
+
+        # repeated calls get their answers in recorded order
+        self.assertEquals([{'label': 'satellite-1'}], connection.orgapi.organizations())
+        self.assertEquals(2, len(connection.orgapi.organizations()))
+        self.assertEquals({'uuid': 'abc'}, connection.systemapi.system(system_id='abc'))
+        self.assertEquals('PK\x03\x04\xff', connection.orgapi.export())
+        self.assertRaises(cassette.RecordedError, connection.systemapi.checkin,
+                          'abc', datetime(2013, 5, 1))
+
+    def test_replay_miss(self):
+        self.record()
+        connection = self.replay_connection()
+        self.assertRaises(cassette.CassetteMiss, connection.systemapi.system, system_id='xyz')
+
+    @patch('time.sleep')
+    def test_replay_latency(self, sleep):
+        self.record()
+        connection = self.replay_connection(latency=True)
+        connection.systemapi.system(system_id='abc')
+        self.assertEquals(1, sleep.call_count)
@@ -13,14 +13,28 @@
 
 
 from mock import Mock, patch
+import os
+import shutil
 import socket
+import tempfile
 
 from base import SpliceToolTest
 
 from spacewalk_splice_tool import checkin
+from spacewalk_splice_tool import katello_connect
+from spacewalk_splice_tool import metrics
+from spacewalk_splice_tool import spool
+from spacewalk_splice_tool import state
 from spacewalk_splice_tool import sw_client
 
 
+def spacewalk_id_index(uuids_by_sw_id):
+    index = katello_connect.SpacewalkIDIndex()
+    for (org_id, spacewalk_id), uuid in uuids_by_sw_id.items():
+        index.add(org_id, uuid, spacewalk_id)
+    return index
+
+
 class CheckinTest(SpliceToolTest):
 
     def setUp(self):
@@ -29,7 +43,7 @@ class CheckinTest(SpliceToolTest):
     def test_main(self):
         mocked_sw_sync = self.mock(checkin, 'spacewalk_sync')
         mocked_splice_sync = self.mock(checkin, 'splice_sync')
-        options = Mock()
+        options = Mock(record=None, replay=None)
 
         def reset():
             mocked_sw_sync.reset_mock()
@@ -64,9 +78,10 @@ class CheckinTest(SpliceToolTest):
         mocked_cp_client_class.return_value = mocked_cp_client
 
         mocked_sw_client.get_user_list.return_value = user_list
-        mocked_sw_client.get_system_list.return_value = system_list
+        mocked_sw_client.iter_system_list.return_value = iter(system_list)
         mocked_sw_client.get_channel_list.return_value = channel_list
         mocked_sw_client.get_org_list.return_value = org_list
+        mocked_sw_client.get_host_guest_list.return_value = []
 
         mocked_cp_client.getOwners.return_value = owner_list
         mocked_cp_client.getRedhatProvider.return_value = provider
@@ -77,17 +92,371 @@ class CheckinTest(SpliceToolTest):
         options = Mock()
         delete_stale_consumers = self.mock(checkin, 'delete_stale_consumers')
         upload_to_cp = self.mock(checkin, 'upload_to_katello')
+        # the consumers are streamed, so they only exist as the upload reads them
+        uploaded = []
+        upload_to_cp.side_effect = lambda consumers, *args: uploaded.extend(consumers)
+        # registered with self.mock so the original is put back on teardown
+        self.mock(checkin, 'METRICS')
+        checkin.METRICS = metrics.RunMetrics()
 
         checkin.spacewalk_sync(options)
 
         # base channel was set to RH channel
         self.assertEquals('rhel-x86_64-server-6',
                           system_list[1]['software_channel'])
-        self.assertTrue(delete_stale_consumers.called)
         self.assertTrue(system_list[0].has_key('installed_products'))
         self.assertTrue(system_list[1].has_key('installed_products'))
         self.assertTrue(upload_to_cp.called)
-        self.assertEquals(2, len(upload_to_cp.call_args[0][0]))
+        self.assertEquals(2, len(uploaded))
+        self.assertEquals(2, checkin.METRICS.get('katello_upload').items)
+        self.assertEquals(2, checkin.METRICS.get('fact_translation').items)
+        # stale consumers are found from the ids seen in the stream
+        self.assertTrue(delete_stale_consumers.called)
+        self.assertEquals(set(system['server_id'] for system in system_list),
+                          delete_stale_consumers.call_args[0][2])
+        # one detailed listing serves both the upload and the deletion
+        mocked_cp_client.getConsumers.assert_called_once_with()
+        self.assertEquals(consumer_list, upload_to_cp.call_args[0][3])
+        self.assertFalse(mocked_sw_client.get_system_list.called)
+
+    def test_stream_consumers_in_workers(self):
+        systems = [dict(system, installed_products=[]) for system in system_list]
+        self.mock(checkin, 'METRICS')
+        checkin.METRICS = metrics.RunMetrics()
+
+        consumers = list(checkin.stream_consumers(iter(systems), workers=2))
+
+        self.assertEquals(checkin.transform_to_consumers(systems), consumers)
+        self.assertEquals(2, checkin.METRICS.get('fact_translation').items)
+
+    def test_fetch_spacewalk_data(self):
+        mocked_sw_client = Mock()
+        mocked_sw_client.get_user_list.return_value = user_list
+        mocked_sw_client.get_system_list.return_value = system_list
+        mocked_sw_client.get_channel_list.return_value = channel_list
+        mocked_sw_client.get_host_guest_list.return_value = []
+        mocked_sw_client.get_org_list.return_value = org_list
+
+        data = checkin.fetch_spacewalk_data(mocked_sw_client, workers=3)
+
+        self.assertEquals(user_list, data['users'])
+        self.assertEquals(system_list, data['systems'])
+        self.assertEquals(channel_list, data['channels'])
+        self.assertEquals([], data['hosts_guests'])
+        self.assertEquals(org_list, data['orgs'])
+        self.assertEquals(set(['users', 'systems', 'channels', 'hosts_guests', 'orgs']),
+                          set(data['timings'].keys()))
+
+    def test_get_product_ids_memoized(self):
+        checkin.reset_product_index()
+        read_mapping_file = self.mock(checkin.utils, 'read_mapping_file',
+            {'rhel-x86_64-server-6': 'Server-Server-x86_64-1234-69.pem'})
+
+        first = checkin.get_product_ids('rhel-x86_64-server-6;some-child')
+        second = checkin.get_product_ids('rhel-x86_64-server-6;some-child')
+        other = checkin.get_product_ids('rhel-x86_64-server-6')
+
+        self.assertEquals([{'productId': 69,
+                            'productName': 'Red Hat Enterprise Linux Server'}], first)
+        self.assertTrue(first is second)
+        self.assertEquals(first, other)
+        self.assertEquals(1, read_mapping_file.call_count)
+        self.assertEquals(1, checkin.CERT_DIR.findByProduct.call_count)
+        checkin.reset_product_index()
+
+    def test_channel_mapping(self):
+        channel_map = checkin.channel_mapping(channel_list)
+        self.assertEquals({'clone-rhel-x86_64-server-6': 'rhel-x86_64-server-6',
+                           'clone-2-rhel-x86_64-server-6': 'rhel-x86_64-server-6',
+                           'clone-clone-2-rhel-x86_64-server-6': 'rhel-x86_64-server-6'},
+                          channel_map)
+
+    def test_channel_mapping_cycle(self):
+        channels = [{'new_channel_label': 'a', 'original_channel_label': 'b'},
+                    {'new_channel_label': 'b', 'original_channel_label': 'a'},
+                    {'new_channel_label': 'c', 'original_channel_label': 'a'}]
+        channel_map = checkin.channel_mapping(channels)
+        self.assertEquals('b', channel_map['a'])
+        self.assertEquals('a', channel_map['b'])
+        self.assertEquals('b', channel_map['c'])
+
+    def test_upload_to_katello(self):
+        mocked_cp_client = Mock()
+        mocked_cp_client.getSpacewalkIDIndex.return_value = spacewalk_id_index(
+            {('satellite-1', '1000010001'): 'existing-uuid'})
+        consumers = [{'id': '1000010001', 'owner': '1', 'name': 'existing',
+                      'facts': {}, 'installed_products': [],
+                      'last_checkin': '2013-04-25 15:25:34'},
+                     {'id': '1000010002', 'owner': '1', 'name': 'new',
+                      'facts': {}, 'installed_products': [],
+                      'last_checkin': '2013-05-03 13:15:03'}]
+
+        checkin.upload_to_katello(consumers, mocked_cp_client)
+
+        self.assertFalse(mocked_cp_client.findBySpacewalkID.called)
+        self.assertEquals(1, mocked_cp_client.updateConsumer.call_count)
+        self.assertEquals('existing-uuid',
+            mocked_cp_client.updateConsumer.call_args[1]['cp_uuid'])
+        self.assertEquals(1, mocked_cp_client.createConsumer.call_count)
+        self.assertEquals('1000010002',
+            mocked_cp_client.createConsumer.call_args[1]['sw_uuid'])
+
+    def test_spacewalk_id_index_from_listing(self):
+        with patch.object(katello_connect.KatelloConnection, '__init__', lambda self: None):
+            katello_client = katello_connect.KatelloConnection()
+        katello_client.orgapi = Mock()
+        katello_client.orgapi.organizations.return_value = [{'label': 'satellite-1'}]
+        katello_client.systemapi = Mock()
+        katello_client.systemapi.systems_by_org.return_value = consumer_list
+
+        index = katello_client.getSpacewalkIDIndex()
+
+        # the listing has no spacewalk ids, which must not read as "not in
+        # katello"
+        self.assertEquals((None, False), index.lookup('satellite-1', '1000010001'))
+        self.assertEquals(set(c['uuid'] for c in consumer_list), index.uuids)
+
+    def test_spacewalk_id_index_from_details(self):
+        with patch.object(katello_connect.KatelloConnection, '__init__', lambda self: None):
+            katello_client = katello_connect.KatelloConnection()
+        katello_client.systemapi = Mock()
+        details = [{'uuid': 'uuid-1', 'owner': {'key': 'satellite-1'},
+                    'facts': {'systemid': '1000010001'}},
+                   {'uuid': 'uuid-2', 'owner': {'key': 'satellite-1'},
+                    'facts': {'systemid': '1000010002'}}]
+
+        index = katello_client.getSpacewalkIDIndex(details)
+
+        self.assertFalse(katello_client.systemapi.systems_by_org.called)
+        self.assertEquals(('uuid-2', True), index.lookup('satellite-1', '1000010002'))
+        # every system had a spacewalk id, so one not in the index is new
+        self.assertEquals((None, True), index.lookup('satellite-1', '1000010003'))
+
+    def test_harvest_consumers_skips_deleted(self):
+        with patch.object(katello_connect.KatelloConnection, '__init__', lambda self: None):
+            katello_client = katello_connect.KatelloConnection()
+        katello_client.systemapi = Mock()
+
+        def system(system_id):
+            if system_id == 'gone':
+                raise katello_connect.server.ServerRequestError(
+                    404, {'displayMessage': 'no such system'})
+            return {'uuid': system_id}
+        katello_client.systemapi.system.side_effect = system
+        listing = [{'uuid': 'uuid-1'}, {'uuid': 'gone'}, {'uuid': 'uuid-2'}]
+
+        harvested = list(katello_client.harvestConsumers(listing, workers=1))
+        self.assertEquals(['uuid-1', 'uuid-2'], [c['uuid'] for c in harvested])
+
+        # any other failure stops the harvest right away
+        katello_client.systemapi.subscriptions.side_effect = [
+            {'entitlements': []}, Exception("katello is down")]
+        harvested = katello_client.harvestConsumers(listing, workers=1)
+        self.assertEquals('uuid-1', harvested.next()['uuid'])
+        self.assertRaises(Exception, harvested.next)
+
+    def test_upload_to_katello_from_listing(self):
+        state_dir = tempfile.mkdtemp()
+        try:
+            state_path = os.path.join(state_dir, 'katello_consumers.json')
+            mocked_cp_client = Mock()
+            index = katello_connect.SpacewalkIDIndex()
+            for system in consumer_list:
+                index.add('satellite-1', system['uuid'])
+            mocked_cp_client.getSpacewalkIDIndex.return_value = index
+            existing_uuid = consumer_list[0]['uuid']
+            mocked_cp_client.findBySpacewalkID.return_value = [{'uuid': existing_uuid}]
+            consumers = [{'id': '1000010001', 'owner': '1', 'name': 'existing',
+                          'facts': {}, 'installed_products': [],
+                          'last_checkin': '2013-04-25 15:25:34'}]
+
+            checkin.upload_to_katello(consumers, mocked_cp_client,
+                                      state.StateStore(state_path))
+
+            mocked_cp_client.findBySpacewalkID.assert_called_once_with('satellite-1', '1000010001')
+            self.assertFalse(mocked_cp_client.createConsumer.called)
+            self.assertEquals(existing_uuid,
+                mocked_cp_client.updateConsumer.call_args[1]['cp_uuid'])
+
+            # the next run knows the uuid from the state store
+            mocked_cp_client.reset_mock()
+            checkin.upload_to_katello(consumers, mocked_cp_client,
+                                      state.StateStore(state_path))
+            self.assertFalse(mocked_cp_client.findBySpacewalkID.called)
+            self.assertFalse(mocked_cp_client.updateConsumer.called)
+            self.assertFalse(mocked_cp_client.createConsumer.called)
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_upload_to_katello_failures(self):
+        mocked_cp_client = Mock()
+        mocked_cp_client.getSpacewalkIDIndex.return_value = spacewalk_id_index({})
+        mocked_cp_client.createConsumer.side_effect = [Exception("boom"), 'new-uuid']
+        consumers = [{'id': '1', 'owner': '1', 'name': 'bad', 'facts': {},
+                      'installed_products': [], 'last_checkin': '2013-04-25 15:25:34'},
+                     {'id': '2', 'owner': '1', 'name': 'good', 'facts': {},
+                      'installed_products': [], 'last_checkin': '2013-04-25 15:25:34'}]
+
+        failures = checkin.upload_to_katello(consumers, mocked_cp_client)
+
+        # the failed consumer does not stop the rest of the upload
+        self.assertEquals(2, mocked_cp_client.createConsumer.call_count)
+        self.assertEquals([('1', 'boom')], failures)
+
+    def test_upload_to_katello_skips_unchanged(self):
+        state_dir = tempfile.mkdtemp()
+        try:
+            state_path = os.path.join(state_dir, 'katello_consumers.json')
+            mocked_cp_client = Mock()
+            mocked_cp_client.getSpacewalkIDIndex.return_value = spacewalk_id_index(
+                {('satellite-1', '1000010001'): 'existing-uuid'})
+            mocked_cp_client.createConsumer.return_value = 'new-uuid'
+            consumers = [{'id': '1000010001', 'owner': '1', 'name': 'existing',
+                          'facts': {'cpu.cpu(s)': 2}, 'installed_products': [],
+                          'last_checkin': '2013-04-25 15:25:34'},
+                         {'id': '1000010002', 'owner': '1', 'name': 'new',
+                          'facts': {'cpu.cpu(s)': 1}, 'installed_products': [],
+                          'last_checkin': '2013-05-03 13:15:03'}]
+
+            checkin.upload_to_katello(consumers, mocked_cp_client,
+                                      state.StateStore(state_path))
+            self.assertEquals(1, mocked_cp_client.updateConsumer.call_count)
+            self.assertEquals(1, mocked_cp_client.createConsumer.call_count)
+
+            # the second run only writes the consumer that checked in again
+            mocked_cp_client.reset_mock()
+            mocked_cp_client.getSpacewalkIDIndex.return_value = spacewalk_id_index(
+                {('satellite-1', '1000010001'): 'existing-uuid',
+                 ('satellite-1', '1000010002'): 'new-uuid'})
+            consumers[1]['last_checkin'] = '2013-05-04 13:15:03'
+            checkin.upload_to_katello(consumers, mocked_cp_client,
+                                      state.StateStore(state_path))
+            self.assertFalse(mocked_cp_client.createConsumer.called)
+            self.assertEquals(1, mocked_cp_client.updateConsumer.call_count)
+            self.assertEquals('new-uuid',
+                mocked_cp_client.updateConsumer.call_args[1]['cp_uuid'])
+        finally:
+            shutil.rmtree(state_dir)
+
+    def mock_splice_sync(self):
+        mocked_cp_client_class = self.mock(checkin, 'KatelloConnection')
+        mocked_cp_client = Mock()
+        mocked_cp_client_class.return_value = mocked_cp_client
+        mocked_cp_client.getConsumers.return_value = consumer_list
+        mocked_cp_client.harvestConsumers.side_effect = \
+            lambda consumers: iter([c for c in full_consumer_list
+                                    if c['uuid'] in [x['uuid'] for x in consumers]])
+        self.mock(checkin, 'get_checkin_config', {'cert': 'cert'})
+        self.get_uuid = self.mock(checkin, '_get_splice_server_uuid', 'sst-uuid')
+        self.state_dir = tempfile.mkdtemp()
+        self.mock(checkin, 'get_state_store',
+                  state.StateStore(os.path.join(self.state_dir, 'splice_sync.json')))
+        self.rcs_spool = spool.ChunkSpool(os.path.join(self.state_dir, 'rcs_spool'))
+        self.mock(checkin, 'get_rcs_spool', self.rcs_spool)
+        return mocked_cp_client_class, mocked_cp_client
+
+    def uploaded_mpu(self, upload_to_rcs):
+        rcs_spool = upload_to_rcs.call_args[0][0]
+        mpu = []
+        for chunk in rcs_spool.pending():
+            mpu.extend(rcs_spool.read(chunk)['objects'])
+            rcs_spool.accept(chunk)
+        return mpu
+
+    def test_splice_sync(self):
+        mocked_cp_client_class, mocked_cp_client = self.mock_splice_sync()
+        upload_to_rcs = self.mock(checkin, 'upload_to_rcs')
+        options = Mock()
+        options.sample_json = None
+        options.full_sync = True
+
+        try:
+            checkin.splice_sync(options)
+            mpu = self.uploaded_mpu(upload_to_rcs)
+        finally:
+            shutil.rmtree(self.state_dir)
+
+        # one connection and one pass for details and entitlements
+        self.assertEquals(1, mocked_cp_client_class.call_count)
+        self.assertFalse(mocked_cp_client.getEntitlements.called)
+        self.assertEquals(1, len(mpu))
+        self.assertEquals('sst-uuid', mpu[0]['splice_server'])
+        self.assertEquals('6b60e3e2-a614-4c20-b2c0-2e4cbfc821d1',
+                          mpu[0]['instance_identifier'])
+        self.assertEquals([{'account': '1234', 'contract': '5678',
+                            'product': 'RH0103708', 'quantity': 1}],
+                          mpu[0]['product_info'])
+        self.assertEquals('ec2-23-20-74-50', mpu[0]['facts']['network_dot_hostname'])
+
+    def test_splice_sync_incremental(self):
+        mocked_cp_client_class, mocked_cp_client = self.mock_splice_sync()
+        upload_to_rcs = self.mock(checkin, 'upload_to_rcs')
+        options = Mock()
+        options.sample_json = None
+        options.full_sync = False
+
+        try:
+            # no high water mark yet, so everything is sent
+            checkin.splice_sync(options)
+            self.assertEquals(2, len(mocked_cp_client.harvestConsumers.call_args[0][0]))
+            self.assertEquals(1, len(self.uploaded_mpu(upload_to_rcs)))
+            self.assertEquals('2013-05-03T20:37:56+00:00',
+                              checkin.get_state_store().get('high_water_mark'))
+
+            # nothing changed since the last run
+            upload_to_rcs.reset_mock()
+            checkin.splice_sync(options)
+            self.assertFalse(upload_to_rcs.called)
+
+            # only the consumer that was updated is sent
+            consumer_list[0]['updated_at'] = u'2013-05-04T10:00:00Z'
+            checkin.splice_sync(options)
+            sent = mocked_cp_client.harvestConsumers.call_args[0][0]
+            self.assertEquals([consumer_list[0]['uuid']], [c['uuid'] for c in sent])
+        finally:
+            consumer_list[0]['updated_at'] = u'2013-05-03T20:37:54Z'
+            shutil.rmtree(self.state_dir)
+
+    def test_sync_context(self):
+        get_uuid = self.mock(checkin, '_get_splice_server_uuid', 'sst-uuid')
+        context = checkin.SyncContext({'cert': 'cert'})
+        mpu = [checkin.transform_to_rcs(c, context) for c in full_consumer_list * 3]
+        self.assertEquals(['sst-uuid'] * 3, [m['splice_server'] for m in mpu])
+        # the identity cert is parsed once per run, not once per consumer
+        get_uuid.assert_called_once_with({'cert': 'cert'})
+
+    def test_upload_to_rcs_resumes(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            rcs_spool = spool.ChunkSpool(spool_dir)
+            self.assertEquals(3, rcs_spool.add([{'name': str(i)} for i in range(5)], 2))
+            context = checkin.SyncContext(
+                      {'host': 'rcs', 'port': 443, 'handler': '/splice/api',
+                       'cert': 'cert', 'key': 'key', 'ca': 'ca',
+                       'retries': 1, 'retry_delay': 0, 'gzip': False})
+            self.mock(checkin, 'build_server_metadata', {'objects': []})
+            self.mock(checkin.time, 'sleep')
+            splice_conn = Mock()
+            self.mock(checkin, 'BaseConnection', splice_conn)
+
+            # the second chunk fails twice, so the run stops with it pending
+            splice_conn.POST.return_value = (204, '')
+            splice_conn.POST_file.side_effect = [(202, ''), (500, ''), Exception("timeout")]
+            self.assertRaises(SystemExit, checkin.upload_to_rcs, rcs_spool, context)
+            pending = rcs_spool.pending()
+            self.assertEquals(2, len(pending))
+            self.assertEquals([{'name': '2'}, {'name': '3'}],
+                              rcs_spool.read(pending[0])['objects'])
+
+            # the next run only sends what is left
+            splice_conn.POST_file.reset_mock()
+            splice_conn.POST_file.side_effect = None
+            splice_conn.POST_file.return_value = (202, '')
+            checkin.upload_to_rcs(rcs_spool, context)
+            self.assertEquals(2, splice_conn.POST_file.call_count)
+            self.assertEquals([], rcs_spool.pending())
+        finally:
+            shutil.rmtree(spool_dir)
 
     def test_host_guest_sync(self):
         mocked_cp_client = Mock()
@@ -273,3 +642,18 @@ consumer_list = \
       u'updated_at': u'2013-05-03T20:37:56Z',
       u'uuid': u'f8e2e155-31f4-4e25-acbd-8eb951bd23ac'}]
 
+full_consumer_list = \
+    [{u'name': u'ec2-23-20-74-50.compute-1.amazonaws.com',
+      u'uuid': u'6b60e3e2-a614-4c20-b2c0-2e4cbfc821d1',
+      u'checkin_time': u'2013-05-03T20:37:54Z',
+      u'updated_at': u'2013-05-03T20:37:54Z',
+      u'serviceLevel': u'',
+      u'environment': {u'organization_id': 3},
+      u'owner': {u'key': u'satellite-1', u'displayName': u'Red Hat (Internal Use Only)'},
+      u'facts': {u'network.hostname': u'ec2-23-20-74-50',
+                 u'cpu.cpu_socket(s)': u'1'},
+      'entitlement_status': {u'status': u'valid'},
+      'entitlements': [{u'accountNumber': u'1234',
+                        u'contractNumber': u'5678',
+                        u'productId': u'RH0103708',
+                        u'quantity': 1}]}]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import gzip
+import httplib
+import json
+import os
+import shutil
+import socket
+import StringIO
+import tempfile
+
+from mock import Mock
+
+from base import SpliceToolTest
+
+from spacewalk_splice_tool import cassette
+from spacewalk_splice_tool import connect
+
+
+class BaseConnectionTest(SpliceToolTest):
+
+    def setUp(self):
+        super(BaseConnectionTest, self).setUp()
+        self.response = Mock()
+        self.response.configure_mock(status=202, will_close=False)
+        self.response.read.return_value = '{"result": "ok"}'
+        self.https_conn = Mock()
+        self.https_conn.getresponse.return_value = self.response
+        self.https_class = self.mock(connect.httpslib, 'HTTPSConnection', self.https_conn)
+        self.context_class = self.mock(connect.SSL, 'Context')
+
+    def test_connection_reused(self):
+        conn = connect.BaseConnection('rcs', 443, '/splice/api',
+                                      cert_file='cert', key_file='key', ca_cert='ca')
+        self.assertEquals((202, {'result': 'ok'}), conn.POST('/v1/foo/', {'a': 1}))
+        self.assertEquals((202, {'result': 'ok'}), conn.POST('/v1/foo/', {'a': 2}))
+        self.assertEquals(1, self.https_class.call_count)
+        self.assertEquals(1, self.context_class.call_count)
+        self.assertEquals(2, self.https_conn.request.call_count)
+
+    def test_reconnect_after_dropped_connection(self):
+        conn = connect.BaseConnection('rcs', 443, '/splice/api')
+        conn.POST('/v1/foo/', {'a': 1})
+        self.https_conn.request.side_effect = [socket.error("reset"), None]
+        self.assertEquals(202, conn.POST('/v1/foo/', {'a': 2})[0])
+        self.assertEquals(2, self.https_class.call_count)
+        self.assertEquals(1, self.context_class.call_count)
+
+    def test_no_resend_after_post_sent(self):
+        conn = connect.BaseConnection('rcs', 443, '/splice/api')
+        conn.POST('/v1/foo/', {'a': 1})
+        # the request went out, so the server may have stored it
+        self.https_conn.getresponse.side_effect = [httplib.BadStatusLine(''), self.response]
+        self.assertRaises(httplib.BadStatusLine, conn.POST, '/v1/foo/', {'a': 2})
+        self.assertEquals(2, self.https_conn.request.call_count)
+
+    def test_resend_get_after_sent(self):
+        conn = connect.BaseConnection('rcs', 443, '/splice/api')
+        conn.GET('/v1/foo/')
+        self.https_conn.getresponse.side_effect = [httplib.BadStatusLine(''), self.response]
+        self.assertEquals(202, conn.GET('/v1/foo/')[0])
+        self.assertEquals(3, self.https_conn.request.call_count)
+
+    def test_gzip_body(self):
+        conn = connect.BaseConnection('rcs', 443, '/splice/api', gzip_body=True)
+        conn.POST('/v1/foo/', {'a': 1})
+        kwargs = self.https_conn.request.call_args[1]
+        self.assertEquals('gzip', kwargs['headers']['Content-Encoding'])
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(kwargs['body'])).read()
+        self.assertEquals({'a': 1}, json.loads(body))
+
+    def test_record_and_replay(self):
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'cassette.json')
+        try:
+            cassette.install(path, cassette.RECORD)
+            conn = connect.BaseConnection('rcs', 443, '/splice/api')
+            self.assertEquals((202, {'result': 'ok'}), conn.POST('/v1/foo/', {'a': 1}))
+
+            cassette.install(path, cassette.REPLAY)
+            self.https_conn.request.side_effect = socket.error("no network")
+            conn = connect.BaseConnection('rcs', 443, '/splice/api')
+            self.assertEquals([202, {'result': 'ok'}], conn.POST('/v1/foo/', {'a': 2}))
+            self.assertRaises(cassette.CassetteMiss, conn.POST, '/v1/foo/', {'a': 3})
+        finally:
+            cassette.uninstall()
+            shutil.rmtree(tmp_dir)
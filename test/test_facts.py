@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import unittest
+
+from spacewalk_splice_tool import facts
+
+HARDWARE = '4 CPUs 2 Sockets; eth0 10.96.161.145/255.255.255.0 12:31:39:16:a2:67; ' \
+           'lo 127.0.0.1/255.0.0.0 00:00:00:00:00:00'
+
+
+class FactsTest(unittest.TestCase):
+
+    def test_parse_hardware(self):
+        self.assertEquals(('4', [('eth0', '10.96.161.145', '255.255.255.0', '12:31:39:16:a2:67'),
+                                 ('lo', '127.0.0.1', '255.0.0.0', '00:00:00:00:00:00')]),
+                          facts.parse_hardware(HARDWARE))
+        self.assertEquals((None, []), facts.parse_hardware(''))
+        self.assertEquals((None, []), facts.parse_hardware(None))
+
+    def test_translate(self):
+        details = {'server_id': '100', 'sockets': '2', 'hardware': HARDWARE,
+                   'architecture': 'x86_64', 'memory': '1024',
+                   'ip_address': '10.96.161.145', 'hostname': 'host.example.com'}
+        result = facts.translate_sw_facts_to_subsmgr(details)
+        self.assertEquals('4', result['cpu.cpu(s)'])
+        self.assertEquals(2, result['lscpu.core(s)_per_socket'])
+        self.assertEquals('255.255.255.0', result['net.interface.eth0.netmask'])
+        self.assertEquals('00:00:00:00:00:00', result['net.interface.lo.mac_address'])
+        self.assertEquals(1024 * 1024, result['memory.memtotal'])
+        # the builders parse the column themselves when called on their own
+        self.assertEquals(facts.network_facts(details),
+                          facts.network_facts(details, facts.parse_hardware(HARDWARE)))
+
+    def test_no_hardware(self):
+        details = {'server_id': '100', 'sockets': '', 'hardware': '',
+                   'architecture': 'x86_64', 'memory': '',
+                   'ip_address': '10.96.161.145', 'hostname': 'host.example.com'}
+        result = facts.translate_sw_facts_to_subsmgr(details)
+        self.assertEquals(1, result['cpu.cpu(s)'])
+        self.assertEquals(1, result['lscpu.cpu_socket(s)'])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from spacewalk_splice_tool import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('spacewalk_splice_tool.metrics.time')
+    def test_phase(self, mocked_time):
+        mocked_time.time.side_effect = [100.0, 101.0, 105.0, 110.0, 112.0]
+        run = metrics.RunMetrics()
+        with run.phase('upload') as phase:
+            phase.items = 20
+        with run.phase('upload', 10):
+            pass
+
+        upload = run.get('upload')
+        self.assertEquals(6.0, upload.seconds)
+        self.assertEquals(30, upload.items)
+        self.assertEquals(5.0, upload.items_per_second())
+
+    def test_failed_phase(self):
+        run = metrics.RunMetrics()
+        try:
+            with run.phase('rcs_push', 3):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+        self.assertTrue(run.get('rcs_push').failed)
+
+    def test_write_json(self):
+        run = metrics.RunMetrics()
+        run.add('report_systems', 2.0, 100)
+        run.finish(True)
+        path = os.path.join(self.tmp_dir, 'metrics', 'run.json')
+        run.write(path)
+
+        data = json.load(open(path))
+        self.assertTrue(data['success'])
+        self.assertEquals([{'name': 'report_systems', 'seconds': 2.0, 'items': 100,
+                            'items_per_second': 50.0, 'failed': False}],
+                          data['phases'])
+
+    def test_write_textfile(self):
+        run = metrics.RunMetrics()
+        run.add('report_systems', 2.0, 100)
+        run.add('owner_sync', 1.0)
+        run.finish(False)
+        path = os.path.join(self.tmp_dir, 'checkin.prom')
+        run.write(path)
+
+        lines = open(path).read().splitlines()
+        self.assertTrue('spacewalk_splice_tool_run_success 0.0' in lines)
+        self.assertTrue('spacewalk_splice_tool_phase_seconds{phase="owner_sync"} 1.0' in lines)
+        self.assertTrue('spacewalk_splice_tool_phase_items_per_second{phase="report_systems"} 50.0' in lines)
+        # phases without an item count get no items sample
+        self.assertFalse([l for l in lines if l.startswith('spacewalk_splice_tool_phase_items{phase="owner_sync"}')])
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_write_textfile_mode(self):
+        run = metrics.RunMetrics('splice')
+        run.add('rcs_push', 1.0, 10)
+        run.finish(True)
+        lines = run.to_textfile().splitlines()
+        self.assertTrue('spacewalk_splice_tool_run_success{mode="splice"} 1.0' in lines)
+        self.assertTrue('spacewalk_splice_tool_phase_seconds{mode="splice",phase="rcs_push"} 1.0' in lines)
+        self.assertEquals('splice', run.to_dict()['mode'])
+
+    def test_mode_path(self):
+        self.assertEquals('/tmp/checkin-spacewalk.prom',
+                          metrics.mode_path('/tmp/checkin.prom', 'spacewalk'))
+        self.assertEquals('/tmp/metrics-full', metrics.mode_path('/tmp/metrics', 'full'))
+        self.assertEquals('/tmp/checkin.prom', metrics.mode_path('/tmp/checkin.prom', None))
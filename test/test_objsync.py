@@ -11,6 +11,8 @@
 # have received a copy of GPLv2 along with this software; if not, see
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 
+import os
+
 from mock import Mock, call
 
 from spacewalk_splice_tool import checkin
@@ -70,10 +72,13 @@ class TestObjectSync(SpliceToolTest):
         self.cp_client.getUsers = Mock(return_value=kt_userlist)
         self.cp_client.createOrgAdminRolePermission = Mock()
         self.cp_client.getRoles = Mock(side_effect=return_role)
-        self.cp_client.getRoles = Mock(side_effect=return_role)
         self.cp_client.createDistributor = Mock(return_value={'uuid':'100100'})
         self.cp_client.getRedhatProvider = Mock(return_value={'id':'99999'})
         self.cp_client.exportManifest = Mock(return_value="FILECONTENT")
+        self.imported = []
+        def import_manifest(prov_id, file):
+            self.imported.append(file.read())
+        self.cp_client.importManifest = Mock(side_effect=import_manifest)
 
     def test_owner_add(self):
         sw_orgs = {'1': 'foo', '2': 'bar', '3': 'baz'}
@@ -81,9 +86,14 @@ class TestObjectSync(SpliceToolTest):
         self.cp_client.createOwner.assert_called_once_with(name='baz', label='satellite-3')
         self.cp_client.createDistributor.assert_called_once_with(name="Distributor for baz", root_org='satellite-1')
         self.cp_client.exportManifest.assert_called_once_with(dist_uuid='100100')
-        # TODO: actually check the file contents
         true_matcher = TestObjectSync.Matcher(self.true_compare, "x")
         self.cp_client.importManifest.assert_called_once_with(prov_id='99999', file=true_matcher)
+        self.assertEquals(["FILECONTENT"], self.imported)
+        # the manifest file is closed and gone once the import is done
+        manifest_file = self.cp_client.importManifest.call_args[1]['file']
+        self.assertTrue(manifest_file.closed)
+        self.assertFalse(os.path.exists(manifest_file.name))
+        self.cp_client.getOwners.assert_called_once_with()
         self.cp_client.createOrgAdminRolePermission.assert_called_once_with(kt_org_label='satellite-3')
 
     def test_owner_delete(self):
@@ -113,11 +123,40 @@ class TestObjectSync(SpliceToolTest):
                             { 'name': '102', 'uuid': '1-1-4', 'owner': {'key': 'NOT-A-SAT-ORG'}, 'facts': {'systemid': '103'}},
                             { 'name': '107', 'uuid': '1-1-5', 'owner': {'key': 'satellite-1'}, 'facts': {'systemid': '107'}}
                          ]
-        checkin.delete_stale_consumers(self.cp_client, kt_consumer_list, sw_system_list)
+        checkin.delete_stale_consumers(self.cp_client, kt_consumer_list,
+                                       [system['server_id'] for system in sw_system_list])
         expected = [call('1-1-3'), call('1-1-5')]
         result = self.cp_client.deleteConsumer.call_args_list
         assert result == expected, "%s does not match expected call set %s" % (result, expected)
 
+    def test_system_remove_capped(self):
+        checkin.CONFIG.add_section('katello')
+        checkin.CONFIG.set('katello', 'max_deletions', '1')
+        kt_consumer_list = [
+                            { 'name': '102', 'uuid': '1-1-3', 'owner': {'key': 'satellite-2'}, 'facts': {'systemid': '102'}},
+                            { 'name': '107', 'uuid': '1-1-5', 'owner': {'key': 'satellite-1'}, 'facts': {'systemid': '107'}}
+                         ]
+        checkin.delete_stale_consumers(self.cp_client, kt_consumer_list, ['100'])
+        expected = [call('1-1-3')]
+        result = self.cp_client.deleteConsumer.call_args_list
+        assert result == expected, "%s does not match expected call set %s" % (result, expected)
+
+    def test_system_remove_capped_by_default(self):
+        kt_consumer_list = [{'name': str(i), 'uuid': 'uuid-%s' % i, 'owner': {'key': 'satellite-1'},
+                             'facts': {'systemid': str(i)}}
+                            for i in range(checkin.DEFAULT_MAX_DELETIONS + 10)]
+        checkin.delete_stale_consumers(self.cp_client, kt_consumer_list, ['100000'])
+        self.assertEquals(checkin.DEFAULT_MAX_DELETIONS, self.cp_client.deleteConsumer.call_count)
+
+    def test_system_remove_without_spacewalk_systems(self):
+        # an empty report must not read as "every system was deleted"
+        kt_consumer_list = [
+                            { 'name': '102', 'uuid': '1-1-3', 'owner': {'key': 'satellite-2'}, 'facts': {'systemid': '102'}},
+                            { 'name': '107', 'uuid': '1-1-5', 'owner': {'key': 'satellite-1'}, 'facts': {'systemid': '107'}}
+                         ]
+        checkin.delete_stale_consumers(self.cp_client, kt_consumer_list, [])
+        self.assertFalse(self.cp_client.deleteConsumer.called)
+
     def test_user_add(self):
         sw_userlist = [{'username': 'foo', 'user_id': '1',
                         'organization_id': '1', 'role': 'Organization Administrator;Satellite Administrator',
@@ -126,10 +165,12 @@ class TestObjectSync(SpliceToolTest):
                         'organization_id': '2', 'role': 'Organization Administrator', 'organization': 'foo org',
                         'email': 'bar@foo.com'}]
 
-        checkin.update_users(self.cp_client, sw_userlist)
+        kt_users = checkin.update_users(self.cp_client, sw_userlist)
         expected = [call(username='barbar', email='bar@foo.com')]
         result = self.cp_client.createUser.call_args_list
         assert result == expected, "%s does not match expected call set %s" % (result, expected)
+        # new users are handed on to the role sync
+        self.assertEquals(['admin', 'barbar', 'bazbaz', 'foo'], sorted(kt_users.keys()))
 
     def test_role_update(self):
         sw_userlist = [{'username': 'foo', 'user_id': '1', 'organization_id': '1',
@@ -141,6 +182,8 @@ class TestObjectSync(SpliceToolTest):
                         {'username': 'bazbaz', 'user_id': '3', 'organization_id': '1',
                         'role': '', 'organization': 'foo org', 'email': 'baz@foo.com'}]
         checkin.update_roles(self.cp_client, sw_userlist)
+        # only users in both spacewalk and katello have their roles looked up
+        self.assertEquals(2, self.cp_client.getRoles.call_count)
 
         # user "foo" is an org admin on sat org 1, and needs to get added to
         # satellite-1 in katello
@@ -161,4 +204,3 @@ class TestObjectSync(SpliceToolTest):
 
         # ensure user "bazbaz" had full admin rights revoked 
         self.cp_client.ungrantFullAdmin.assert_called_once_with(kt_user=user_matcher)
-        
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+from multiprocessing.pool import ThreadPool
+import unittest
+
+from mock import patch
+
+from spacewalk_splice_tool import metrics, pipeline
+
+
+def square(i):
+    return i * i
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_buffered(self):
+        self.assertEquals(range(50), list(pipeline.buffered(iter(range(50)), 3)))
+
+    def test_buffered_reraises(self):
+        def source():
+            yield 1
+            raise ValueError("report went away")
+
+        items = pipeline.buffered(source(), 10)
+        self.assertEquals(1, items.next())
+        self.assertRaises(ValueError, items.next)
+
+    def test_buffered_is_bounded(self):
+        read = []
+
+        def source():
+            for i in range(100):
+                read.append(i)
+                yield i
+
+        items = pipeline.buffered(source(), 5)
+        self.assertEquals(0, items.next())
+        items.close()
+        # one taken, five queued and one waiting to be queued at most
+        self.assertTrue(len(read) <= 7)
+
+    def test_stage(self):
+        closed = []
+
+        def source():
+            try:
+                for i in range(10):
+                    yield i
+            finally:
+                closed.append(True)
+
+        run = metrics.RunMetrics()
+        doubled = pipeline.stage(lambda i: i * 2, source(), 'double', run)
+        self.assertEquals([0, 2, 4], [doubled.next() for i in range(3)])
+        doubled.close()
+        self.assertEquals([True], closed)
+        self.assertEquals(3, run.get('double').items)
+
+    def test_process_map(self):
+        pairs = list(pipeline.process_map(square, iter(range(25)), 2, chunk_size=4))
+        self.assertEquals([(i, i * i) for i in range(25)], pairs)
+
+    def test_pool_map_is_bounded(self):
+        read = []
+
+        def args():
+            for i in range(100):
+                read.append(i)
+                yield (i,)
+
+        results = pipeline.pool_map(ThreadPool(2), square, args(), 4)
+        self.assertEquals(((0,), 0), results.next())
+        self.assertEquals(4, len(read))
+        results.close()
+        self.assertEquals([((i,), i * i) for i in range(5)],
+                          list(pipeline.pool_map(ThreadPool(2), square,
+                                                 ((i,) for i in range(5)), 2)))
+
+    def test_process_map_metrics(self):
+        run = metrics.RunMetrics()
+        pairs = pipeline.process_map(square, iter(range(10)), 2, 4, 'square', run)
+        self.assertEquals(range(10), [item for item, _ in pairs])
+        self.assertEquals(10, run.get('square').items)
+        self.assertTrue(run.get('square').seconds >= 0.0)
+
+    @patch('spacewalk_splice_tool.pipeline.time')
+    def test_map_chunk_timed(self, mocked_time):
+        mocked_time.time.side_effect = [1.0, 3.5]
+        self.assertEquals((2.5, [0, 1, 4]), pipeline._map_chunk(square, [0, 1, 2]))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import pickle
+import unittest
+
+from spacewalk_splice_tool import records
+
+
+class RecordsTest(unittest.TestCase):
+
+    def test_system_row(self):
+        row = records.SystemRow.from_csv(['server_id', 'hardware', 'unknown'],
+                                         ['100', '1 CPUs 1 Sockets', 'x'])
+        self.assertEquals('100', row['server_id'])
+        self.assertEquals('x', row['unknown'])
+        self.assertFalse(row.has_key('sockets'))
+        self.assertEquals(None, row.get('sockets'))
+        self.assertRaises(KeyError, lambda: row['sockets'])
+
+        row.update({'installed_products': [69]})
+        self.assertEquals({'server_id': '100', 'hardware': '1 CPUs 1 Sockets',
+                           'unknown': 'x', 'installed_products': [69]}, row.to_dict())
+        self.assertEquals(row, pickle.loads(pickle.dumps(row, 2)))
+
+    def test_facts(self):
+        facts = records.Facts({'lscpu.model': '', 'cpu.cpu(s)': '2'})
+        other = records.Facts({'cpu.cpu(s)': '4', 'lscpu.model': ''})
+        # systems with the same fact names share the key tuple
+        self.assertTrue(facts._keys is other._keys)
+        self.assertEquals('2', facts['cpu.cpu(s)'])
+        self.assertTrue('lscpu.model' in facts)
+        self.assertEquals({'lscpu.model': '', 'cpu.cpu(s)': '2'}, dict(facts))
+        self.assertEquals(facts, pickle.loads(pickle.dumps(facts, 2)))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from spacewalk_splice_tool import spool
+
+
+records = [{'name': 'a,b', 'facts': {'note': 'line one\nline two,'}},
+           {'name': u'é', 'facts': {}},
+           {'name': ']}', 'facts': {'list': [1, 2]}}]
+
+
+class SpoolTest(unittest.TestCase):
+
+    def test_json_objects_round_trip(self):
+        f = StringIO.StringIO()
+        writer = spool.JsonObjectsWriter(f)
+        for record in records:
+            writer.write(record)
+        writer.close()
+
+        self.assertEquals({'objects': records}, json.loads(f.getvalue()))
+        f.seek(0)
+        self.assertEquals(records, list(spool.iter_json_objects(f)))
+
+    def test_chunks(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            rcs_spool = spool.ChunkSpool(spool_dir)
+            # records can be a generator, and are consumed as chunks are written
+            self.assertEquals(2, rcs_spool.add(iter(records), 2))
+            pending = rcs_spool.pending()
+            self.assertEquals(records[:2], rcs_spool.read(pending[0])['objects'])
+            self.assertEquals(records, list(rcs_spool.records()))
+
+            rcs_spool.accept(pending[0])
+            self.assertEquals(records[2:], list(rcs_spool.records()))
+            self.assertEquals(0, rcs_spool.add([], 2))
+        finally:
+            shutil.rmtree(spool_dir)
+
+    def test_failed_chunk_removed(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            def harvest():
+                for record in records:
+                    yield record
+                raise Exception("katello went away")
+
+            rcs_spool = spool.ChunkSpool(spool_dir)
+            self.assertRaises(Exception, rcs_spool.add, harvest(), 2)
+            # the full chunk is kept, the partial one is not left behind
+            self.assertEquals(['.json'], [os.path.splitext(name)[1]
+                                          for name in os.listdir(spool_dir)])
+            self.assertEquals(records[:2], list(rcs_spool.records()))
+        finally:
+            shutil.rmtree(spool_dir)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import StringIO
+
+from mock import Mock
+
+from base import SpliceToolTest
+
+from spacewalk_splice_tool import records
+from spacewalk_splice_tool import sw_client
+
+
+users_report = """username,organization_id,organization,role
+admin,1,Red Hat,Organization Administrator
+foo,2,Foo Org,
+"""
+
+systems_report = """server_id,org_id,software_channel
+1000010001,1,rhel-x86_64-server-6
+1000010002,1,rhel-x86_64-server-6
+"""
+
+
+class SpacewalkClientTest(SpliceToolTest):
+
+    def setUp(self):
+        super(SpacewalkClientTest, self).setUp()
+        self.process = Mock()
+        self.process.stdout = StringIO.StringIO(users_report)
+        self.process.returncode = 0
+        self.popen = self.mock(sw_client.subprocess, 'Popen', self.process)
+        self.client = sw_client.SpacewalkClient('spacewalkhost', 'key_path')
+
+    def test_iter_db_output(self):
+        rows = self.client.iter_db_output('users')
+        # nothing is run until the generator is consumed
+        self.assertFalse(self.popen.called)
+        first = rows.next()
+        self.assertEquals('admin', first['username'])
+        self.assertFalse(self.process.wait.called)
+
+        rest = list(rows)
+        self.assertEquals(1, len(rest))
+        self.assertEquals('2', rest[0]['organization_id'])
+        self.assertTrue(self.process.wait.called)
+
+    def test_iter_db_output_failed_report(self):
+        # ssh dropped after the first row
+        self.process.stdout = StringIO.StringIO(users_report.splitlines(True)[0] +
+                                                users_report.splitlines(True)[1])
+        self.process.returncode = 255
+        rows = self.client.iter_db_output('users')
+        self.assertEquals('admin', rows.next()['username'])
+        self.assertRaises(sw_client.ReportError, rows.next)
+
+    def test_iter_db_output_no_output(self):
+        # ssh failed before the report printed anything
+        self.process.stdout = StringIO.StringIO('')
+        self.process.returncode = 255
+        self.assertRaises(sw_client.ReportError, list,
+                          self.client.iter_db_output('splice-export'))
+        self.assertRaises(sw_client.ReportError, list,
+                          self.client.iter_db_output('users'))
+
+    def test_iter_db_output_closed_early(self):
+        self.process.returncode = -13
+        rows = self.client.iter_db_output('users')
+        rows.next()
+        rows.close()
+        self.assertTrue(self.process.wait.called)
+
+    def test_get_db_output(self):
+        rows = self.client.get_db_output('users')
+        self.assertEquals(['admin', 'foo'], [r['username'] for r in rows])
+        args = self.popen.call_args[0][0]
+        self.assertEquals(['/usr/bin/spacewalk-report', 'users'], args[-2:])
+
+    def test_report_uses_control_master(self):
+        self.process.poll.return_value = None
+        self.mock(sw_client.os.path, 'exists', True)
+        self.mock(sw_client.subprocess, 'call')
+        self.client.connect()
+        self.client.get_db_output('users')
+        args = self.popen.call_args[0][0]
+        self.assertTrue('-S' in args)
+        self.assertTrue('ControlMaster=no' in args)
+
+        self.client.close()
+        exit_args = sw_client.subprocess.call.call_args[0][0]
+        self.assertEquals(['-O', 'exit'], exit_args[3:5])
+
+    def test_control_master_fallback(self):
+        # the master exits straight away, e.g. on an auth failure
+        self.process.poll.return_value = 255
+        self.mock(sw_client.os.path, 'exists', False)
+        self.client.connect()
+        self.client.get_db_output('users')
+        args = self.popen.call_args[0][0]
+        self.assertFalse('-S' in args)
+
+    def test_users_report_runs_once(self):
+        users = self.client.get_user_list()
+        orgs = self.client.get_org_list()
+        self.assertEquals(1, self.popen.call_count)
+        self.assertEquals(2, len(users))
+        self.assertEquals({'1': 'Red Hat', '2': 'Foo Org'}, orgs)
+
+    def test_system_rows_are_records(self):
+        self.process.stdout = StringIO.StringIO(systems_report)
+        rows = list(self.client.iter_system_list())
+        self.assertTrue(isinstance(rows[0], records.SystemRow))
+        self.assertEquals({'server_id': '1000010001', 'org_id': '1',
+                           'software_channel': 'rhel-x86_64-server-6'}, rows[0])
+        # repeated values are shared between rows
+        self.assertTrue(rows[0]['software_channel'] is rows[1]['software_channel'])